@@ -0,0 +1,21 @@
+###############################################################################
+#  __init__.py for archivist scour microservice                               #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Entry point for the gateway module."""
+from .upstreams import Upstream, UpstreamRegistry, UnknownDevice, registry
+from .router import GatewayRouter
+
+__all__ = ["Upstream", "UpstreamRegistry", "UnknownDevice", "registry",
+           "GatewayRouter"]
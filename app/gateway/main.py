@@ -0,0 +1,46 @@
+###############################################################################
+#  main.py for archivist scour microservice                                   #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Entry point for the gateway mode of the microservice.
+
+The gateway never talks to sane itself, it fronts the scour instances
+listed in SCOUR_UPSTREAMS (name=url,...) or registered at runtime.
+"""
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from .router import GatewayRouter
+from .upstreams import registry, configured_upstreams
+
+origins = [
+    "*"
+]
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Register the configured upstreams and close them on exit."""
+    for name, url in configured_upstreams():
+        await registry.add(name, url)
+    yield
+    await registry.aclose()
+
+
+app = FastAPI(title="Scour Gateway", version="0.0.1", lifespan=lifespan)
+app.include_router(GatewayRouter)
+app.add_middleware(CORSMiddleware, allow_origins=origins,
+                   allow_credentials=True, allow_methods=["*"],
+                   allow_headers=["*"])
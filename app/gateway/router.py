@@ -0,0 +1,128 @@
+###############################################################################
+#  router.py for archivist scour microservice                                 #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Gateway routes."""
+import asyncio
+from typing import Dict, List
+from urllib.parse import quote
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from .upstreams import registry, UnknownDevice, GATEWAY_DISCOVERY_TIMEOUT
+
+GatewayRouter = APIRouter(tags=['gateway'])
+
+PROXY_METHODS = ['GET', 'PUT', 'POST', 'DELETE']
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate',
+              'proxy-authorization', 'te', 'trailer', 'transfer-encoding',
+              'upgrade', 'host'}
+
+
+def _headers(headers) -> Dict[str, str]:
+    """Return headers without the hop-by-hop ones."""
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP}
+
+
+async def _proxy(request: Request, prefix: str, device_name: str,
+                 path: str = '') -> StreamingResponse:
+    """Forward a request to the upstream fronting a device.
+
+    Bodies are streamed through in both directions so page images and
+    archives are never buffered by the gateway.
+    """
+    try:
+        upstream, name = await registry.resolve(device_name)
+    except UnknownDevice as ex:
+        raise HTTPException(404, str(ex)) from ex
+
+    url = f"{prefix}/{quote(name, safe='')}" + (f"/{path}" if path else '')
+    req = upstream.client.build_request(
+        request.method, url, params=request.query_params,
+        headers=_headers(request.headers), content=request.stream())
+    try:
+        response = await upstream.client.send(req, stream=True)
+    except httpx.HTTPError as ex:
+        raise HTTPException(502, f"Upstream {upstream.name} failed: "
+                            f"{str(ex)}") from ex
+
+    return StreamingResponse(response.aiter_raw(),
+                             status_code=response.status_code,
+                             headers=_headers(response.headers),
+                             background=BackgroundTask(response.aclose))
+
+
+@GatewayRouter.get('/gateway/upstreams')
+async def get_upstreams() -> List[Dict]:
+    """Return the registered upstream instances."""
+    return [u.info() for u in registry.upstreams()]
+
+
+@GatewayRouter.put('/gateway/upstreams/{name}')
+async def add_upstream(name: str, url: str) -> List[Dict]:
+    """Register an upstream scour instance."""
+    try:
+        await registry.add(name, url)
+    except ValueError as ex:
+        raise HTTPException(400, str(ex)) from ex
+    return [u.info() for u in registry.upstreams()]
+
+
+@GatewayRouter.delete('/gateway/upstreams/{name}')
+async def remove_upstream(name: str) -> List[Dict]:
+    """Unregister an upstream scour instance."""
+    await registry.remove(name)
+    return [u.info() for u in registry.upstreams()]
+
+
+@GatewayRouter.get('/devices')
+@GatewayRouter.get('/service/devices')
+async def get_devices() -> List[Dict]:
+    """Return the merged devices of every upstream."""
+    return await registry.devices()
+
+
+@GatewayRouter.get('/service/refresh_devices')
+async def refresh_devices() -> List[Dict]:
+    """Have every upstream rediscover its devices.
+
+    A site that doesn't answer in time keeps its last known devices.
+    """
+    await asyncio.gather(*(u.client.get('/service/refresh_devices',
+                                        timeout=GATEWAY_DISCOVERY_TIMEOUT)
+                           for u in registry.upstreams()),
+                         return_exceptions=True)
+    return await registry.devices(refresh=True)
+
+
+@GatewayRouter.api_route('/service/devices/{device_name}',
+                         methods=PROXY_METHODS)
+async def proxy_service_device(request: Request, device_name: str):
+    """Forward a service device request."""
+    return await _proxy(request, '/service/devices', device_name)
+
+
+@GatewayRouter.api_route('/service/devices/{device_name}/{path:path}',
+                         methods=PROXY_METHODS)
+async def proxy_service(request: Request, device_name: str, path: str):
+    """Forward a service device action."""
+    return await _proxy(request, '/service/devices', device_name, path)
+
+
+@GatewayRouter.api_route('/devices/{device_name}/{path:path}',
+                         methods=PROXY_METHODS)
+async def proxy_device(request: Request, device_name: str, path: str):
+    """Forward a device request."""
+    return await _proxy(request, '/devices', device_name, path)
@@ -0,0 +1,170 @@
+###############################################################################
+#  upstreams.py for archivist scour microservice                              #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Upstream scour instances fronted by the gateway."""
+import asyncio
+import os
+from time import monotonic
+from typing import Dict, List, Tuple
+import httpx
+
+GATEWAY_TTL = float(os.environ.get('SCOUR_GATEWAY_TTL', 30))
+GATEWAY_CONNECTIONS = int(os.environ.get('SCOUR_GATEWAY_CONNECTIONS', 20))
+GATEWAY_CONNECT_TIMEOUT = float(os.environ.get(
+    'SCOUR_GATEWAY_CONNECT_TIMEOUT', 10))
+# Rediscovery makes the sites probe their networks, allow it some time
+GATEWAY_DISCOVERY_TIMEOUT = float(os.environ.get(
+    'SCOUR_GATEWAY_DISCOVERY_TIMEOUT', 30))
+SEPARATOR = '@'
+
+
+class UnknownDevice(Exception):
+    """Raised when no upstream fronts a device."""
+
+
+class Upstream():
+    """A scour instance and its cached device list."""
+
+    def __init__(self, name: str, url: str,
+                 transport: httpx.AsyncBaseTransport = None) -> None:
+        """Initialize the upstream and its connection pool.
+
+        Proxied bodies may stream for as long as a scan or an export
+        takes, only connecting to the site is bounded.
+        """
+        self.name = name
+        self.url = url
+        self.client = httpx.AsyncClient(
+            base_url=url, transport=transport,
+            timeout=httpx.Timeout(None, connect=GATEWAY_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=GATEWAY_CONNECTIONS,
+                                max_keepalive_connections=GATEWAY_CONNECTIONS))
+        self.devices: List[Dict] = []
+        self.fetched = None
+        self.error = ""
+        self._lock = asyncio.Lock()
+
+    def stale(self, ttl: float) -> bool:
+        """Return true if the device list is older than ttl."""
+        return self.fetched is None or monotonic() - self.fetched >= ttl
+
+    async def refresh(self, ttl: float = 0) -> List[Dict]:
+        """Fetch the device list unless another caller just did."""
+        async with self._lock:
+            if self.stale(ttl):
+                try:
+                    response = await self.client.get('/service/devices',
+                                                     timeout=10)
+                    response.raise_for_status()
+                    self.devices = response.json()
+                    self.error = ""
+                except (httpx.HTTPError, ValueError) as ex:
+                    # Keep serving the last known devices of this site
+                    self.error = f"{type(ex).__name__}: {str(ex)}"
+                self.fetched = monotonic()
+        return self.devices
+
+    def info(self) -> Dict:
+        """Return a description of the upstream."""
+        return {'name': self.name, 'url': self.url, 'error': self.error,
+                'devices': [d['device_name'] for d in self.devices]}
+
+    async def aclose(self) -> None:
+        """Close the connection pool."""
+        await self.client.aclose()
+
+
+class UpstreamRegistry():
+    """The upstreams of the gateway and the merged device list.
+
+    Devices are listed as 'device_name@upstream'. Unqualified names are
+    accepted as long as a single upstream fronts that device.
+    """
+
+    def __init__(self, ttl: float = GATEWAY_TTL) -> None:
+        """Initialize an empty registry."""
+        self.ttl = ttl
+        self._upstreams: Dict[str, Upstream] = {}
+
+    def upstreams(self) -> List[Upstream]:
+        """Return the registered upstreams."""
+        return list(self._upstreams.values())
+
+    async def add(self, name: str, url: str,
+                  transport: httpx.AsyncBaseTransport = None) -> Upstream:
+        """Register an upstream, replacing one of the same name."""
+        if SEPARATOR in name:
+            raise ValueError(f"Upstream names may not contain {SEPARATOR}")
+
+        await self.remove(name)
+        upstream = Upstream(name, url.rstrip('/'), transport)
+        self._upstreams[name] = upstream
+        return upstream
+
+    async def remove(self, name: str) -> None:
+        """Unregister an upstream."""
+        upstream = self._upstreams.pop(name, None)
+        if upstream is not None:
+            await upstream.aclose()
+
+    async def devices(self, refresh: bool = False) -> List[Dict]:
+        """Return the devices of every upstream, refreshing stale lists."""
+        ttl = 0 if refresh else self.ttl
+        upstreams = self.upstreams()
+        lists = await asyncio.gather(*(u.refresh(ttl) for u in upstreams))
+        return [{**device,
+                 'device_name': f"{device['device_name']}{SEPARATOR}{u.name}",
+                 'upstream': u.name}
+                for u, devices in zip(upstreams, lists) for device in devices]
+
+    async def resolve(self, device_name: str) -> Tuple[Upstream, str]:
+        """Return the upstream fronting a device and its upstream name."""
+        name, _, upstream_name = device_name.rpartition(SEPARATOR)
+        if name and upstream_name in self._upstreams:
+            return self._upstreams[upstream_name], name
+
+        for refresh in (False, True):
+            ttl = min(self.ttl, 1.0) if refresh else self.ttl
+            upstreams = self.upstreams()
+            lists = await asyncio.gather(*(u.refresh(ttl)
+                                           for u in upstreams))
+            owners = [u for u, devices in zip(upstreams, lists)
+                      if any(d['device_name'] == device_name
+                             for d in devices)]
+            if len(owners) == 1:
+                return owners[0], device_name
+            if len(owners) > 1:
+                raise UnknownDevice(
+                    f"Device {device_name} is ambiguous, use one of " +
+                    ", ".join(f"{device_name}{SEPARATOR}{u.name}"
+                              for u in owners))
+
+        raise UnknownDevice(f"Device {device_name} not found.")
+
+    async def aclose(self) -> None:
+        """Close every upstream."""
+        for upstream in self.upstreams():
+            await upstream.aclose()
+        self._upstreams.clear()
+
+
+def configured_upstreams() -> List[Tuple[str, str]]:
+    """Return the upstreams listed as name=url in SCOUR_UPSTREAMS."""
+    return [tuple(entry.split('=', 1))
+            for entry in os.environ.get('SCOUR_UPSTREAMS', '').split(',')
+            if '=' in entry]
+
+
+registry = UpstreamRegistry()
@@ -15,15 +15,33 @@
 ###############################################################################
 """Main enrty point for fastapi microservice."""
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from .models import service
+from .models.handles import handles, PREWARM_DEVICES
+from .models.sinks import dispatcher
 from .routers import ServiceRouter, DevicesRouter
 
 origins = [
     "*"
 ]
 
-app = FastAPI(title="Scour", version="0.0.1")
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Start and stop the background services."""
+    handles.start()
+    if PREWARM_DEVICES:
+        await asyncio.to_thread(service.prewarm, PREWARM_DEVICES)
+    yield
+    # Let queued pages reach their sinks before exiting
+    dispatcher.shutdown(wait=True)
+    handles.stop()
+
+
+app = FastAPI(title="Scour", version="0.0.1", lifespan=lifespan)
 app.include_router(ServiceRouter)
 app.include_router(DevicesRouter)
 app.add_middleware(CORSMiddleware, allow_origins=origins,
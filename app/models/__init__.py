@@ -18,11 +18,11 @@
 import sane
 from .service import Service
 from .device import Device, DeviceParameter, DeviceOption
-from .job import Job, JobStatus
+from .job import Job, JobStatus, JobSummary
 
 SaneException = sane._sane.error
 
 service = Service()
 
 __all__ = ["service", "Device", "DeviceParameter", "DeviceOption",
-           "SaneException", "Job", "JobStatus"]
+           "SaneException", "Job", "JobStatus", "JobSummary"]
@@ -0,0 +1,75 @@
+###############################################################################
+#  acquisition.py for archivist scour microservice                            #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Raw frame acquisition from sane devices."""
+from contextlib import AbstractContextManager
+from typing import Callable, Iterator
+import sane
+from .encoding import RawFrame
+
+SaneException = sane._sane.error
+
+ADF_EMPTY = 'Document feeder out of documents'
+
+
+def snap_frame(sane_dev, no_cancel: bool = False) -> RawFrame:
+    """Read a started frame into a raw frame.
+
+    This calls the binding's snap directly, sane.SaneDev.snap would copy
+    the buffer to bytes and again into a PIL image.
+    """
+    data, width, height, samples, _ = sane_dev.dev.snap(
+        no_cancel, False, None)
+    if not data:
+        raise RuntimeError("Scanner returned no data")
+
+    return RawFrame(data, width, height, samples)
+
+
+def _read_sheet(hold: Callable[[], AbstractContextManager],
+                adf: bool) -> RawFrame | None:
+    """Start and read one sheet, None once the feeder is empty."""
+    with hold() as sane_dev:
+        try:
+            sane_dev.start()
+        except SaneException as ex:
+            if adf and str(ex) == ADF_EMPTY:
+                return None
+            raise
+        return snap_frame(sane_dev, adf)
+
+
+def acquire_frames(hold: Callable[[], AbstractContextManager],
+                   adf: bool) -> Iterator[RawFrame]:
+    """Yield the frames of a flatbed scan or of every page in the feeder.
+
+    hold returns a context manager over the sane handle. It is only held
+    while a sheet is read so other callers get a turn between sheets.
+    """
+    if not adf:
+        yield _read_sheet(hold, False)
+        return
+
+    try:
+        while True:
+            frame = _read_sheet(hold, True)
+            if frame is None:
+                return
+            yield frame
+            # Drop our reference before the next sheet is read
+            del frame
+    finally:
+        with hold() as sane_dev:
+            sane_dev.cancel()
@@ -0,0 +1,189 @@
+###############################################################################
+#  admission.py for archivist scour microservice                              #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Admission control and backpressure for scans."""
+import os
+from contextlib import contextmanager
+from threading import Condition
+from time import monotonic
+from typing import Callable, Iterator
+from .buffers import buffers
+from .sinks import dispatcher
+
+MAX_INFLIGHT_BYTES = int(os.environ.get('SCOUR_MAX_INFLIGHT_BYTES', 1 << 30))
+MAX_QUEUE_DEPTH = int(os.environ.get('SCOUR_MAX_QUEUE_DEPTH', 64))
+RSS_FRACTION = float(os.environ.get('SCOUR_MAX_RSS_FRACTION', 0.85))
+RETRY_AFTER = int(os.environ.get('SCOUR_RETRY_AFTER', 5))
+THROTTLE_TIMEOUT = float(os.environ.get('SCOUR_THROTTLE_TIMEOUT', 60))
+
+_CGROUP_LIMITS = ['/sys/fs/cgroup/memory.max',
+                  '/sys/fs/cgroup/memory/memory.limit_in_bytes']
+
+
+class ScanDeferred(Exception):
+    """Raised when a scan is refused until the service has caught up."""
+
+    def __init__(self, reason: str, retry_after: int = RETRY_AFTER) -> None:
+        """Initialize the exception."""
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def physical_memory() -> int:
+    """Return the physical memory of the host in bytes, 0 if unknown."""
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def memory_limit() -> int:
+    """Return the container memory limit in bytes.
+
+    Without a cgroup limit the physical memory is the limit, 0 only when
+    neither is known.
+    """
+    for path in _CGROUP_LIMITS:
+        try:
+            with open(path, encoding='ascii') as limit:
+                value = limit.read().strip()
+        except OSError:
+            continue
+        # Unlimited shows up as 'max' or as a huge page aligned number
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return physical_memory()
+
+
+def current_rss() -> int:
+    """Return the resident set size of the process in bytes, 0 if unknown."""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class AdmissionController():
+    """Admit scans and pace page reads against the service's backlog.
+
+    Pressure is any of: raw page bytes acquired but not yet encoded
+    plus pooled page buffers above max_inflight_bytes, more than
+    max_queue_depth pages waiting for their sinks, or the process RSS
+    above max_rss. Admitted scans
+    reserve their first page until it is read, so a burst of scans
+    can't all be let in before any of them has allocated a frame.
+    """
+
+    def __init__(self, max_inflight_bytes: int = MAX_INFLIGHT_BYTES,
+                 max_queue_depth: int = MAX_QUEUE_DEPTH,
+                 max_rss: int = None,
+                 queue_depth: Callable[[], int] = lambda: dispatcher.pending,
+                 rss: Callable[[], int] = current_rss,
+                 pooled: Callable[[], int] = lambda: buffers.pooled_bytes
+                 ) -> None:
+        """Initialize the controller."""
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_queue_depth = max_queue_depth
+        self.max_rss = int(memory_limit() * RSS_FRACTION) \
+            if max_rss is None else max_rss
+        self.queue_depth = queue_depth
+        self.rss = rss
+        self.pooled = pooled
+        self._inflight = 0
+        self._reserved = 0
+        self._changed = Condition()
+
+    @property
+    def inflight_bytes(self) -> int:
+        """Return the raw page bytes acquired but not yet encoded."""
+        return self._inflight
+
+    @property
+    def reserved_bytes(self) -> int:
+        """Return the bytes reserved by admitted scans not yet reading."""
+        return self._reserved
+
+    def pressure(self, extra_bytes: int = 0) -> str | None:
+        """Return why the service is under pressure, or None."""
+        with self._changed:
+            pending = self._inflight + self._reserved + self.pooled()
+            # With nothing in flight even an oversized page has to be let in
+            if pending and pending + extra_bytes > self.max_inflight_bytes:
+                return f"{pending} page bytes in flight or pooled"
+            depth = self.queue_depth()
+            if depth > self.max_queue_depth:
+                return f"{depth} pages waiting for delivery"
+            if self.max_rss:
+                rss = self.rss()
+                if rss + self._reserved + extra_bytes > self.max_rss:
+                    return f"memory use at {rss} of {self.max_rss} bytes"
+            return None
+
+    def admit(self, estimated_bytes: int = 0) -> int:
+        """Reserve room for a scan's first page and return the reservation.
+
+        Raises ScanDeferred if a scan of that size can't start now. The
+        reservation is handed back through page() or release().
+        """
+        with self._changed:
+            reason = self.pressure(estimated_bytes)
+            if reason is not None:
+                raise ScanDeferred(f"Scan deferred: {reason}.")
+            self._reserved += estimated_bytes
+        return estimated_bytes
+
+    def release(self, reserved: int) -> None:
+        """Return a reservation that will not be used."""
+        if reserved:
+            with self._changed:
+                self._reserved -= reserved
+                self._changed.notify_all()
+
+    @contextmanager
+    def page(self, nbytes: int, reserved: int = 0) -> Iterator[None]:
+        """Count a raw page as in flight until it has been encoded.
+
+        A reservation given here is released now that the page is
+        counted itself.
+        """
+        with self._changed:
+            self._inflight += nbytes
+            self._reserved -= reserved
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._inflight -= nbytes
+                self._changed.notify_all()
+
+    def throttle(self, timeout: float = THROTTLE_TIMEOUT) -> bool:
+        """Wait before reading the next page while under pressure.
+
+        Gives up after timeout so a batch is slowed down but never
+        abandoned. Returns true if the pressure cleared.
+        """
+        deadline = monotonic() + timeout
+        with self._changed:
+            while self.pressure() is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                # Sink and memory pressure don't notify, so poll as well
+                self._changed.wait(min(remaining, 0.25))
+        return True
+
+
+admission = AdmissionController()
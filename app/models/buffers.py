@@ -0,0 +1,102 @@
+###############################################################################
+#  buffers.py for archivist scour microservice                                #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Pool of reusable NumPy page buffers."""
+import os
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+
+BUFFER_POOL_BYTES = int(os.environ.get('SCOUR_BUFFER_POOL_BYTES', 64 << 20))
+BUFFERS_PER_SHAPE = 2
+
+Shape = Tuple[int, ...]
+
+
+class BufferPool():
+    """Recycle page sized arrays across pages instead of reallocating them.
+
+    At most BUFFERS_PER_SHAPE idle buffers are kept for each shape and
+    never more than max_bytes in total. Idle buffers are dropped with
+    clear() once the scans that used them are over.
+    """
+
+    def __init__(self, max_bytes: int = BUFFER_POOL_BYTES) -> None:
+        """Initialize an empty pool."""
+        self.max_bytes = max_bytes
+        self._free: Dict[tuple, List[np.ndarray]] = {}
+        self._idle_bytes = 0
+        self._lent_bytes = 0
+        self._lock = Lock()
+
+    @property
+    def idle_bytes(self) -> int:
+        """Return the size of the buffers waiting to be reused."""
+        return self._idle_bytes
+
+    @property
+    def pooled_bytes(self) -> int:
+        """Return the size of the idle buffers and of those lent out."""
+        return self._idle_bytes + self._lent_bytes
+
+    def acquire(self, shape: Shape, dtype=np.uint8) -> np.ndarray:
+        """Return an uninitialized array, reusing an idle one if possible."""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                arr = free.pop()
+                self._idle_bytes -= arr.nbytes
+                self._lent_bytes += arr.nbytes
+                return arr
+
+        arr = np.empty(shape, dtype)
+        with self._lock:
+            self._lent_bytes += arr.nbytes
+        return arr
+
+    def release(self, arr: np.ndarray) -> None:
+        """Hand an array back for reuse."""
+        key = (arr.shape, arr.dtype.str)
+        with self._lock:
+            self._lent_bytes -= arr.nbytes
+            free = self._free.setdefault(key, [])
+            if len(free) < BUFFERS_PER_SHAPE and \
+               self._idle_bytes + arr.nbytes <= self.max_bytes:
+                free.append(arr)
+                self._idle_bytes += arr.nbytes
+
+    def reserve(self, shape: Shape, dtype=np.uint8) -> None:
+        """Preallocate a buffer so the first page doesn't pay for it."""
+        self.release(self.acquire(shape, dtype))
+
+    def clear(self) -> None:
+        """Drop every idle buffer."""
+        with self._lock:
+            self._free.clear()
+            self._idle_bytes = 0
+
+    @contextmanager
+    def borrow(self, shape: Shape, dtype=np.uint8) -> Iterator[np.ndarray]:
+        """Lend an array for the duration of a with block."""
+        arr = self.acquire(shape, dtype)
+        try:
+            yield arr
+        finally:
+            self.release(arr)
+
+
+buffers = BufferPool()
@@ -0,0 +1,152 @@
+###############################################################################
+#  dedup.py for archivist scour microservice                                  #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Duplicate and re-fed page detection with perceptual hashes."""
+import os
+from enum import Enum
+from threading import Lock
+from typing import Tuple
+import numpy as np
+
+DUPLICATE_SIMILARITY = float(os.environ.get('SCOUR_DUPLICATE_SIMILARITY',
+                                            0.9))
+DUPLICATE_WINDOW = int(os.environ.get('SCOUR_DUPLICATE_WINDOW', 0))
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+# Pages are decimated to roughly this many lines before averaging
+SAMPLE_LINES = 256
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], np.uint8)
+_GREY = np.array([0.299, 0.587, 0.114], np.float32)
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Return the orthonormal DCT-II matrix."""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    dct = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    dct[0] /= np.sqrt(2)
+    return dct.astype(np.float32)
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+class DuplicateAction(str, Enum):
+    """What to do with pages that duplicate an earlier one."""
+
+    OFF = 'off'
+    FLAG = 'flag'
+    DROP = 'drop'
+
+
+def phash(page: np.ndarray) -> int | None:
+    """Return the 64 bit DCT perceptual hash of a page.
+
+    The page is a (lines, pixels[, samples]) array, pages too small to
+    hash have no hash and None is returned. The page is decimated with a
+    strided view first, so only a few hundred lines of the frame are
+    ever touched.
+    """
+    step = max(1, min(page.shape[0], page.shape[1]) // SAMPLE_LINES)
+    small = page[::step, ::step].astype(np.float32)
+    if small.ndim == 3:
+        small = small @ _GREY if small.shape[2] == 3 else small[..., 0]
+
+    # Block average down to DCT_SIZE x DCT_SIZE, dropping the ragged edge
+    lines, pixels = small.shape[0] // DCT_SIZE, small.shape[1] // DCT_SIZE
+    if lines == 0 or pixels == 0:
+        # A small scan area, nothing meaningful to compare
+        return None
+    blocks = small[:lines * DCT_SIZE, :pixels * DCT_SIZE] \
+        .reshape(DCT_SIZE, lines, DCT_SIZE, pixels).mean(axis=(1, 3))
+
+    low = (_DCT @ blocks @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def similarity(distance: int) -> float:
+    """Return the similarity of two hashes distance bits apart."""
+    return 1 - distance / (HASH_SIZE * HASH_SIZE)
+
+
+class HashIndex():
+    """Fixed capacity ring of page hashes searched by hamming distance."""
+
+    def __init__(self, capacity: int = 1024) -> None:
+        """Initialize an empty index."""
+        self._hashes = np.zeros(capacity, np.uint64)
+        self._keys = np.zeros((capacity, 2), np.int64)
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        """Return the number of indexed hashes."""
+        return min(self._count, len(self._hashes))
+
+    def add(self, page_hash: int, job_number: int, page: int) -> None:
+        """Index the hash of a page, evicting the oldest once full."""
+        with self._lock:
+            slot = self._count % len(self._hashes)
+            self._hashes[slot] = page_hash
+            self._keys[slot] = (job_number, page)
+            self._count += 1
+
+    def nearest(self, page_hash: int) -> Tuple[int, int, int] | None:
+        """Return (distance, job_number, page) of the closest hash."""
+        with self._lock:
+            size = len(self)
+            if size == 0:
+                return None
+            xor = self._hashes[:size] ^ np.uint64(page_hash)
+            distances = _POPCOUNT[xor.view(np.uint8)].reshape(size, 8) \
+                .sum(axis=1)
+            best = int(distances.argmin())
+            return (int(distances[best]), *map(int, self._keys[best]))
+
+
+class DuplicateDetector():
+    """Check each page of a job against the job and a device window."""
+
+    def __init__(self, threshold: float = DUPLICATE_SIMILARITY,
+                 window: HashIndex = None) -> None:
+        """Initialize the detector for one job."""
+        self.max_distance = int((1 - threshold) * HASH_SIZE * HASH_SIZE)
+        self.window = window
+        self._job = HashIndex()
+
+    def check(self, page: np.ndarray) -> Tuple[int | None, Tuple | None]:
+        """Return the page hash and the closest earlier match, if any."""
+        page_hash = phash(page)
+        if page_hash is None:
+            return None, None
+
+        matches = [m for m in (self._job.nearest(page_hash),
+                               self.window.nearest(page_hash)
+                               if self.window is not None else None)
+                   if m is not None and m[0] <= self.max_distance]
+
+        return page_hash, min(matches) if matches else None
+
+    def add(self, page_hash: int | None, job_number: int, page: int) -> None:
+        """Index a kept page, pages without a hash are skipped."""
+        if page_hash is None:
+            return
+
+        self._job.add(page_hash, job_number, page)
+        if self.window is not None:
+            self.window.add(page_hash, job_number, page)
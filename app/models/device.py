@@ -14,17 +14,30 @@
 #  GNU General Public License for more details.                               #
 ###############################################################################
 """Device classes."""
-from threading import Thread
+from contextlib import contextmanager
+from threading import Lock, Thread
 from enum import IntEnum
-from typing import List, Tuple
+from itertools import count
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
 import sane
-from pydantic import BaseModel
-from .job import Job, JobStatus
+from pydantic import BaseModel, PrivateAttr
+from .acquisition import acquire_frames
+from .admission import admission
+from .dedup import (DuplicateAction, DuplicateDetector, HashIndex,
+                    DUPLICATE_WINDOW, similarity)
+from .buffers import buffers
+from .encoding import PageFormat, RawFrame, encode_frame, reserve_buffers
+from .handles import HandleBusy, handles
+from .job import Job
+from .sinks import Sink, SinkConfig, Page, dispatcher, make_sink
 
 SaneException = sane._sane.error
 
 OptionConstraint = None | List[str | int | float] | Tuple[int | float]
 
+_device_serials = count()
+
 
 class DevParams(IntEnum):
     """Sane device parameters."""
@@ -105,33 +118,39 @@ class Device(BaseModel):
     device_status: DevStatus = DevStatus.DISABLED
 
     _sane_dev: object = None
+    _settings: Dict[str, str | int | float] = {}
     _current_job: Job = None
     _jobs: List[Job] = []
     _max_jobs: int = 10
-
-    def __del__(self) -> None:
-        """Destructor for a sane device."""
-        if self._sane_dev is not None:
-            self._sane_dev.close()
+    _options: List[DeviceOption] = None
+    _sinks: List[Sink] = []
+    _recent_pages: HashIndex = None
+    _options_revision: int = 0
+    _serial: int = PrivateAttr(default_factory=lambda: next(_device_serials))
+    _scan_lock: Lock = PrivateAttr(default_factory=Lock)
 
     def enable(self) -> DevStatus:
-        """Enable sane device."""
+        """Enable sane device, reusing a pooled handle if one is open."""
         try:
             if self.device_status == DevStatus.DISABLED:
-                self._sane_dev = sane.open(self.device_name)
                 self.device_status = DevStatus.IDLE
+                with self._device():
+                    pass
 
             return self.device_status
 
         except SaneException as ex:
+            self.device_status = DevStatus.DISABLED
             raise ex from ex
 
     def disable(self) -> DevStatus:
         """Disable a sane device."""
         try:
-            if self.device_status == DevStatus.IDLE:
-                self._sane_dev.close()
+            if self.device_status in (DevStatus.IDLE, DevStatus.ERROR):
+                handles.close(self.device_name)
+                self._sane_dev = None
                 self.device_status = DevStatus.DISABLED
+                self._invalidate_options()
             else:
                 raise DeviceBusy()
             return self.device_status
@@ -140,11 +159,9 @@ class Device(BaseModel):
 
     def parameters(self) -> DeviceParameter:
         """Return the list of device parameters."""
-        if self._sane_dev is None:
-            raise DeviceNotEnabled()
-
         try:
-            parms = self._sane_dev.get_parameters()
+            with self._device() as dev:
+                parms = dev.get_parameters()
             return DeviceParameter(device_format=parms[DevParams.FORMAT],
                                    last_frame=parms[DevParams.LAST_FRAME],
                                    pixelPerLine=parms[DevParams.RESOLUTION][0],
@@ -157,11 +174,21 @@ class Device(BaseModel):
 
     def options(self) -> List[DeviceOption]:
         """Return the current options for a device."""
-        if self._sane_dev is None:
+        if self.device_status == DevStatus.DISABLED:
             raise DeviceNotEnabled()
 
+        if self._options is not None:
+            return self._options
+
         try:
-            dev = self._sane_dev
+            with self._device() as dev:
+                return self._read_options(dev)
+        except SaneException as ex:
+            raise DeviceSaneException(str(ex)) from ex
+
+    def _read_options(self, dev) -> List[DeviceOption]:
+        """Read the options from an open handle."""
+        if self._options is None:
             opt_names = list(filter(lambda opt: opt != 'None',
                                     list(dev.opt.keys())))
             opts = list(map(lambda opt:
@@ -177,74 +204,263 @@ class Device(BaseModel):
                                          cap=dev[opt].cap,
                                          constraint=dev[opt].constraint),
                             opt_names))
-            return opts
-        except SaneException as ex:
-            raise DeviceSaneException(str(ex)) from ex
+            self._options = opts
+        return self._options
 
-        return opts
+    def options_revision(self) -> Tuple[int, int]:
+        """Return a key that changes whenever the device options change."""
+        return (self._serial, self._options_revision)
 
     def set_option(self, option_name: str, option_value: str) -> None:
         """Set a device option."""
-        if self._sane_dev is None:
-            raise DeviceNotEnabled()
+        if self.device_status == DevStatus.SCANNING:
+            # The handle is free between sheets but the scan isn't over
+            raise DeviceBusy()
 
         try:
-            opts = self.options()
-            opt = next(o for o in opts if o.py_name == option_name)
-            value = option_value
-            if opt.option_type in [OptionType.TYPE_BOOL, OptionType.TYPE_INT]:
-                value = int(option_value)
-            elif opt.option_type == OptionType.TYPE_FIXED:
-                value = float(option_value)
-
-            setattr(self._sane_dev, option_name, value)
+            with self._device() as dev:
+                opts = self._read_options(dev)
+                opt = next(o for o in opts if o.py_name == option_name)
+                value = option_value
+                if opt.option_type in [OptionType.TYPE_BOOL,
+                                       OptionType.TYPE_INT]:
+                    value = int(option_value)
+                elif opt.option_type == OptionType.TYPE_FIXED:
+                    value = float(option_value)
+
+                setattr(dev, option_name, value)
+                self._settings[option_name] = value
         except SaneException as ex:
             raise ex from ex
         except AttributeError as ex:
             raise ex from ex
+        finally:
+            # Setting one option may reload others, so always re-read them
+            self._invalidate_options()
+
+    def sinks(self) -> List[SinkConfig]:
+        """Return the output sinks attached to the device."""
+        return [sink.config for sink in self._sinks]
+
+    def add_sink(self, config: SinkConfig) -> List[SinkConfig]:
+        """Attach an output sink, replacing any sink of the same name."""
+        sink = make_sink(config)
+        dispatcher.retire([s for s in self._sinks if s.name == sink.name])
+        self._sinks = [s for s in self._sinks if s.name != sink.name]
+        self._sinks.append(sink)
+        return self.sinks()
+
+    def remove_sink(self, sink_name: str) -> List[SinkConfig]:
+        """Detach an output sink."""
+        sink = next(s for s in self._sinks if s.name == sink_name)
+        self._sinks.remove(sink)
+        dispatcher.retire([sink])
+        return self.sinks()
+
+    def scan(self, sinks: List[SinkConfig] = None,
+             page_format: PageFormat = PageFormat.JPEG,
+             duplicates: DuplicateAction = DuplicateAction.OFF) -> Job:
+        """Use the device to scan.
+
+        Pages are delivered to the device sinks and to any extra sinks
+        given for this scan as soon as they are encoded. Re-fed sheets
+        can be flagged or dropped before they are encoded.
+        """
+        with self._scan_lock:
+            if self.device_status == DevStatus.DISABLED:
+                raise DeviceNotEnabled()
 
-    def scan(self) -> Job:
-        """Use the device to scan."""
-        if self._sane_dev is None:
-            raise DeviceNotEnabled()
+            if self.device_status not in (DevStatus.IDLE, DevStatus.ERROR):
+                raise DeviceBusy()
 
-        if self.device_status is not DevStatus.IDLE:
-            raise DeviceBusy()
+            # Claim the device before the slow work below, the failed
+            # handle of an ERROR device was discarded and gets reopened
+            self.device_status = DevStatus.SCANNING
 
-        self._current_job = Job(job_number=self._get_next_jobid())
-        self._jobs.append(self._current_job)
+        reserved = 0
+        extra_sinks = []
+        try:
+            reserved = admission.admit(self._frame_size())
+            for config in sinks or []:
+                extra_sinks.append(make_sink(config))
+            job = Job(job_number=self._get_next_jobid(),
+                      options={o.py_name: o.value
+                               for o in self.options() if o.active},
+                      page_format=page_format,
+                      duplicate_action=duplicates)
+        except BaseException:
+            admission.release(reserved)
+            dispatcher.retire(extra_sinks)
+            self.device_status = DevStatus.IDLE
+            raise
 
-        Thread(target=self._start_scan).start()
+        self._current_job = job
+        self._jobs.append(job)
 
-        return self._current_job
+        job_sinks = self._sinks + extra_sinks
+        # Sinks replaced while the scan runs stay open until it ends
+        dispatcher.hold(job_sinks)
+        dispatcher.retire(extra_sinks)
+        Thread(target=self._start_scan,
+               args=(job, job_sinks, reserved)).start()
+
+        return job
 
     def get_job(self, jobid: int) -> Job:
         """Return a scan job from the device."""
+        if jobid < 0:
+            # Never let python's negative indexing pick a job from the end
+            raise IndexError(f"Job {jobid} not found.")
         return self._jobs[jobid]
 
+    def find_jobs(self, jobids: List[int] = None, since: datetime = None,
+                  until: datetime = None) -> List[Job]:
+        """Return jobs by id and/or whose start date falls in a range."""
+        jobs = [self.get_job(jobid) for jobid in jobids] if jobids \
+            else list(self._jobs)
+        # Job dates are naive local time, bring aware bounds in line
+        since, until = (d.astimezone().replace(tzinfo=None)
+                        if d is not None and d.tzinfo else d
+                        for d in (since, until))
+
+        return [job for job in jobs
+                if (since is None or job.start_date >= since)
+                and (until is None or job.start_date <= until)]
+
+    @contextmanager
+    def _device(self) -> Iterator[object]:
+        """Hold the pooled sane handle, restoring settings after a reopen.
+
+        Raises DeviceBusy when another thread keeps the handle past the
+        pool's wait.
+        """
+        if self.device_status == DevStatus.DISABLED:
+            raise DeviceNotEnabled()
+
+        try:
+            with handles.use(self.device_name) as dev:
+                if dev is not self._sane_dev:
+                    # A fresh handle starts out with the backend defaults
+                    for name, value in self._settings.items():
+                        setattr(dev, name, value)
+                    self._sane_dev = dev
+                    self._invalidate_options()
+                yield dev
+        except HandleBusy as ex:
+            raise DeviceBusy() from ex
+
+    def _invalidate_options(self) -> None:
+        """Drop the cached option list."""
+        self._options = None
+        self._options_revision += 1
+
     def _get_next_jobid(self) -> int:
         """Return the next available job id."""
         return len(self._jobs)
 
-    def _start_scan(self) -> None:
-        """Private method to do the actual scanning."""
+    def _duplicate_detector(self, job: Job) -> DuplicateDetector | None:
+        """Return a duplicate detector for the job if it wants one.
+
+        With SCOUR_DUPLICATE_WINDOW set pages are also checked against
+        that many of the device's recent pages from earlier jobs.
+        """
+        if job.duplicate_action == DuplicateAction.OFF:
+            return None
+
+        if self._recent_pages is None and DUPLICATE_WINDOW > 0:
+            self._recent_pages = HashIndex(DUPLICATE_WINDOW)
+
+        return DuplicateDetector(window=self._recent_pages)
+
+    def _encode_unique(self, job: Job, frame: RawFrame, position: int,
+                       detector: DuplicateDetector | None) -> tuple:
+        """Return the encoded page and its hash, or no page if dropped."""
+        page_hash = None
+        if detector is not None:
+            page_hash, match = detector.check(frame.array())
+            if match is not None:
+                distance, job_number, page = match
+                job.add_duplicate(position, job_number, page,
+                                  similarity(distance))
+                if job.duplicate_action == DuplicateAction.DROP:
+                    return None, page_hash
+
+        return encode_frame(frame, job.page_format), page_hash
+
+    def _add_page(self, job: Job, data: memoryview,
+                  sinks: List[Sink]) -> None:
+        """Add an encoded page to the job and hand it to the sinks."""
+        job.add_encoded_page(data)
+        if sinks:
+            dispatcher.submit(sinks, Page(self.device_name, job,
+                                          len(job.pages) - 1))
+
+    def _frame_shape(self) -> Tuple[int, int, int] | None:
+        """Return the expected (lines, pixels, samples) of the next frame."""
+        try:
+            params = self.parameters()
+        except DeviceSaneException:
+            return None
+
+        return (params.lines, params.pixelPerLine,
+                1 if params.device_format == 'gray' else 3)
+
+    def _frame_size(self) -> int:
+        """Return the expected raw size of the next frame, 0 if unknown."""
+        shape = self._frame_shape()
+        return max(0, shape[0] * shape[1] * shape[2]) if shape else 0
+
+    def _reserve_buffers(self, job: Job) -> None:
+        """Size the page buffer pool from the device parameters."""
+        shape = self._frame_shape()
+        # Only a hint, the buffers get allocated on first use anyway
+        if shape is not None:
+            reserve_buffers(shape[1], shape[0], shape[2], job.page_format)
+
+    def _start_scan(self, job: Job, sinks: List[Sink],
+                    reserved: int = 0) -> None:
+        """Private method to do the actual scanning.
+
+        The sinks are held for the scan and released when it ends. The
+        admission reservation is handed over to the first page, or
+        returned if none is read.
+        """
         try:
-            self.device_status = DevStatus.SCANNING
             source = next(o for o in self.options() if
                           o.py_name == 'source')
 
-            if source.value.lower() == 'flatbed':
-                page = self._sane_dev.scan()
-                self._current_job.add_pages(page)
-            else:
-                pages = self._sane_dev.multi_scan()
-                for page in pages:
-                    self._current_job.add_pages(page)
+            adf = source.value.lower() != 'flatbed'
+            self._reserve_buffers(job)
+            detector = self._duplicate_detector(job)
+            frames = acquire_frames(self._device, adf)
+            for position, frame in enumerate(frames):
+                with admission.page(len(frame.data), reserved):
+                    reserved = 0
+                    data, page_hash = self._encode_unique(job, frame,
+                                                          position, detector)
+                    # Release the raw frame before the next one is read
+                    del frame
+                if data is not None:
+                    self._add_page(job, data, sinks)
+                    # The job holds the only copy of the page from here
+                    del data
+                    if detector is not None:
+                        detector.add(page_hash, job.job_number,
+                                     len(job.pages) - 1)
+                if adf:
+                    # Hold the next sheet in the feeder while backed up
+                    admission.throttle()
             self.device_status = DevStatus.IDLE
-            self._current_job.status = JobStatus.COMPLETED
-        except SaneException as ex:
+            job.complete()
+        except Exception as ex:
+            # Whatever failed, leave the device and job in a final state
+            # so the next scan isn't refused as busy forever
+            handles.discard(self.device_name)
             self.device_status = DevStatus.ERROR
-            self._current_job.status = JobStatus.ERROR
-            raise ex from ex
-        except StopIteration as ex:
+            job.fail(str(ex) or type(ex).__name__)
             raise ex from ex
+        finally:
+            admission.release(reserved)
+            dispatcher.release(sinks)
+            # Don't keep page sized buffers resident between scans
+            buffers.clear()
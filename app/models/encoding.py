@@ -0,0 +1,261 @@
+###############################################################################
+#  encoding.py for archivist scour microservice                               #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Page encoders working on raw frames one band of lines at a time."""
+import os
+import struct
+import zlib
+from enum import Enum
+from io import BytesIO
+from typing import Iterator
+import numpy as np
+from PIL import Image
+from .buffers import buffers
+
+BAND_LINES = int(os.environ.get('SCOUR_BAND_LINES', 256))
+IDAT_SIZE = 1 << 16
+
+
+class PageFormat(str, Enum):
+    """Encoded page formats."""
+
+    JPEG = 'jpeg'
+    PNG = 'png'
+    TIFF = 'tiff'
+
+    @property
+    def extension(self) -> str:
+        """Return the file extension of the format."""
+        return {'jpeg': 'jpg', 'png': 'png', 'tiff': 'tif'}[self.value]
+
+    @property
+    def content_type(self) -> str:
+        """Return the media type of the format."""
+        return f'image/{self.value}'
+
+
+class RawFrame():
+    """An acquired 8 bit grey or RGB frame as returned by sane."""
+
+    __slots__ = ('data', 'width', 'height', 'samples')
+
+    def __init__(self, data: bytearray, width: int, height: int,
+                 samples: int) -> None:
+        """Initialize a frame over a raw pixel buffer."""
+        self.data = data
+        self.width = width
+        self.height = height
+        self.samples = samples
+
+    @property
+    def mode(self) -> str:
+        """Return the PIL mode of the frame."""
+        return 'RGB' if self.samples == 3 else 'L'
+
+    @property
+    def bytes_per_line(self) -> int:
+        """Return the length of one line of pixels."""
+        return self.width * self.samples
+
+    def array(self) -> np.ndarray:
+        """Return a (lines, pixels, samples) array view of the frame."""
+        return np.frombuffer(self.data, np.uint8).reshape(
+            self.height, self.width, self.samples)
+
+    def bands(self, lines: int = BAND_LINES) -> Iterator[memoryview]:
+        """Yield views of consecutive bands of lines without copying."""
+        view = memoryview(self.data)
+        step = lines * self.bytes_per_line
+        for start in range(0, self.height * self.bytes_per_line, step):
+            yield view[start:start + step]
+
+
+class StripEncoder():
+    """Base class of the incremental encoders.
+
+    Bands are written in order from the top of the page and the encoded
+    page is appended to out as it is produced.
+    """
+
+    def __init__(self, frame: RawFrame, out: BytesIO) -> None:
+        """Initialize the encoder for frames shaped like frame."""
+        self.width = frame.width
+        self.height = frame.height
+        self.samples = frame.samples
+        self.out = out
+
+    @property
+    def bytes_per_line(self) -> int:
+        """Return the length of one line of pixels."""
+        return self.width * self.samples
+
+    def write_band(self, band: memoryview) -> None:
+        """Encode a band of whole lines."""
+        raise NotImplementedError()
+
+    def finish(self) -> None:
+        """Write whatever trails the last band."""
+
+
+class PngStripEncoder(StripEncoder):
+    """Encode PNG by streaming filtered lines through one deflate stream."""
+
+    def __init__(self, frame: RawFrame, out: BytesIO) -> None:
+        """Write the signature and header chunk."""
+        super().__init__(frame, out)
+        self._deflate = zlib.compressobj(6)
+        self._pending = bytearray()
+        self.out.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height,
+                                         8, 2 if self.samples == 3 else 0,
+                                         0, 0, 0))
+
+    def write_band(self, band: memoryview) -> None:
+        """Deflate each line of the band behind a 'none' filter byte."""
+        bpl = self.bytes_per_line
+        for start in range(0, len(band), bpl):
+            self._pending += self._deflate.compress(b'\x00')
+            self._pending += self._deflate.compress(band[start:start + bpl])
+
+        if len(self._pending) >= IDAT_SIZE:
+            self._chunk(b'IDAT', self._pending)
+            self._pending = bytearray()
+
+    def finish(self) -> None:
+        """Flush the deflate stream and close the image."""
+        self._pending += self._deflate.flush()
+        self._chunk(b'IDAT', self._pending)
+        self._chunk(b'IEND', b'')
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        """Write a PNG chunk."""
+        self.out.write(struct.pack('>I', len(data)))
+        self.out.write(kind)
+        self.out.write(data)
+        self.out.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+
+class TiffStripEncoder(StripEncoder):
+    """Encode a deflate compressed TIFF with one strip per band."""
+
+    def __init__(self, frame: RawFrame, out: BytesIO,
+                 rows_per_strip: int = BAND_LINES) -> None:
+        """Write the header, the directory offset is patched in finish."""
+        super().__init__(frame, out)
+        self.rows_per_strip = rows_per_strip
+        self._start = out.tell()
+        self._offsets = []
+        self._counts = []
+        self.out.write(b'II*\x00\x00\x00\x00\x00')
+
+    def write_band(self, band: memoryview) -> None:
+        """Compress the band into a strip."""
+        strip = zlib.compress(band, 6)
+        self._offsets.append(self.out.tell() - self._start)
+        self._counts.append(len(strip))
+        self.out.write(strip)
+
+    def finish(self) -> None:
+        """Write the image file directory."""
+        if self.out.tell() % 2:
+            self.out.write(b'\x00')
+
+        tags = [(256, 4, [self.width]),
+                (257, 4, [self.height]),
+                (258, 3, [8] * self.samples),
+                (259, 3, [8]),
+                (262, 3, [2 if self.samples == 3 else 1]),
+                (273, 4, self._offsets),
+                (277, 3, [self.samples]),
+                (278, 4, [self.rows_per_strip]),
+                (279, 4, self._counts),
+                (284, 3, [1])]
+
+        ifd = self.out.tell() - self._start
+        extra = ifd + 2 + len(tags) * 12 + 4
+        entries = bytearray(struct.pack('<H', len(tags)))
+        values = bytearray()
+        for tag, kind, data in tags:
+            packed = struct.pack(f"<{len(data)}{'H' if kind == 3 else 'I'}",
+                                 *data)
+            if len(packed) <= 4:
+                entries += struct.pack('<HHI', tag, kind, len(data)) \
+                    + packed.ljust(4, b'\x00')
+            else:
+                entries += struct.pack('<HHII', tag, kind, len(data),
+                                       extra + len(values))
+                values += packed
+        entries += struct.pack('<I', 0)
+
+        self.out.write(entries)
+        self.out.write(values)
+        end = self.out.tell()
+        self.out.seek(self._start + 4)
+        self.out.write(struct.pack('<I', ifd))
+        self.out.seek(end)
+
+
+def encode_image(image: Image, page_format: PageFormat) -> bytes:
+    """Encode a PIL image."""
+    buf = BytesIO()
+    image.save(buf, format=page_format.name)
+    return buf.getvalue()
+
+
+def _encode_jpeg(frame: RawFrame, out: BytesIO) -> None:
+    """Encode a raw frame through an image mapped over its pixels.
+
+    Pillow only maps buffers of whole 32 bit pixels, so RGB frames are
+    widened into a pooled RGBX buffer rather than a fresh PIL image.
+    """
+    size = (frame.width, frame.height)
+    if frame.samples == 1:
+        Image.frombuffer('L', size, frame.data, 'raw', 'L', 0, 1).save(
+            out, format='JPEG')
+        return
+
+    with buffers.borrow((frame.height, frame.width, 4)) as rgbx:
+        rgbx[..., :3] = frame.array()
+        Image.frombuffer('RGBX', size, rgbx, 'raw', 'RGBX', 0, 1).save(
+            out, format='JPEG')
+
+
+def reserve_buffers(width: int, lines: int, samples: int,
+                    page_format: PageFormat) -> None:
+    """Preallocate the working buffers for frames of the given size."""
+    if page_format is PageFormat.JPEG and samples == 3 and lines > 0:
+        buffers.reserve((lines, width, 4))
+
+
+def encode_frame(frame: RawFrame, page_format: PageFormat,
+                 band_lines: int = BAND_LINES) -> memoryview:
+    """Encode a raw frame band by band.
+
+    Pillow has no incremental JPEG encoder, JPEG pages are encoded from
+    an image mapped over the frame buffer instead. The page is returned
+    as a view of the encoder output so it is never copied out of it.
+    """
+    out = BytesIO()
+    if page_format is PageFormat.JPEG:
+        _encode_jpeg(frame, out)
+        return out.getbuffer()
+
+    encoder = PngStripEncoder(frame, out) if page_format is PageFormat.PNG \
+        else TiffStripEncoder(frame, out, band_lines)
+    for band in frame.bands(band_lines):
+        encoder.write_band(band)
+    encoder.finish()
+
+    return out.getbuffer()
@@ -0,0 +1,141 @@
+###############################################################################
+#  export.py for archivist scour microservice                                 #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Streaming archive export of scan jobs."""
+import json
+import tarfile
+import zipfile
+from base64 import b64decode
+from enum import Enum
+from io import BytesIO
+from time import time
+from typing import Iterator, List
+from .job import Job
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class ArchiveFormat(str, Enum):
+    """Supported export archive formats."""
+
+    ZIP = 'zip'
+    TAR = 'tar'
+
+    @property
+    def media_type(self) -> str:
+        """Return the http media type of the archive."""
+        return 'application/zip' if self is ArchiveFormat.ZIP \
+            else 'application/x-tar'
+
+
+class _ChunkWriter():
+    """Write only file object that hands back what was written."""
+
+    def __init__(self) -> None:
+        """Initialize the writer."""
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        """Buffer data until the next drain."""
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        """Nothing to flush, data is handed out by drain."""
+
+    def drain(self) -> bytes:
+        """Return and forget everything written since the last drain."""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def safe_name(device_name: str) -> str:
+    """Return a device name usable as a file or directory name."""
+    return device_name.replace(':', '_').replace(';', '_').replace('/', '_')
+
+
+def page_name(job: Job, index: int) -> str:
+    """Return the archive member name of a job page."""
+    return f'job-{job.job_number:04d}/page-{index + 1:04d}.' \
+        f'{job.page_format.extension}'
+
+
+def _snapshot(jobs: List[Job]) -> List[tuple]:
+    """Pin the page lists so pages added mid export don't skew the manifest."""
+    return [(job, list(job.pages)) for job in jobs]
+
+
+def _manifest(device_name: str, snapshot: List[tuple]) -> bytes:
+    """Return the manifest describing the exported jobs."""
+    return json.dumps({
+        'device_name': device_name,
+        'jobs': [{**job.model_dump(mode='json', exclude={'pages'}),
+                  'pages': [page_name(job, i) for i in range(len(pages))]}
+                 for job, pages in snapshot]}, indent=2).encode()
+
+
+def _iter_zip(device_name: str, snapshot: List[tuple]) -> Iterator[bytes]:
+    """Yield a zip archive of the snapshot one member at a time."""
+    out = _ChunkWriter()
+    # Pages are already compressed images, storing avoids a useless deflate
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for job, pages in snapshot:
+            stamp = job.start_date.timetuple()[:6]
+            for index, page in enumerate(pages):
+                info = zipfile.ZipInfo(page_name(job, index), stamp)
+                archive.writestr(info, b64decode(page))
+                yield out.drain()
+
+        archive.writestr(MANIFEST_NAME, _manifest(device_name, snapshot))
+    yield out.drain()
+
+
+def _iter_tar(device_name: str, snapshot: List[tuple]) -> Iterator[bytes]:
+    """Yield a tar archive of the snapshot one member at a time."""
+    out = _ChunkWriter()
+
+    def add(archive: tarfile.TarFile, name: str, data: bytes,
+            mtime: float) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        archive.addfile(info, BytesIO(data))
+
+    with tarfile.open(fileobj=out, mode='w|') as archive:
+        for job, pages in snapshot:
+            for index, page in enumerate(pages):
+                add(archive, page_name(job, index), b64decode(page),
+                    job.start_date.timestamp())
+                yield out.drain()
+
+        add(archive, MANIFEST_NAME, _manifest(device_name, snapshot),
+            time())
+    yield out.drain()
+
+
+def export_jobs(device_name: str, jobs: List[Job],
+                archive_format: ArchiveFormat) -> Iterator[bytes]:
+    """Return an iterator streaming the jobs as an archive.
+
+    Only one decoded page is held at a time, so memory use does not grow
+    with the number or size of the exported jobs.
+    """
+    snapshot = _snapshot(jobs)
+    chunks = _iter_tar(device_name, snapshot) \
+        if archive_format is ArchiveFormat.TAR \
+        else _iter_zip(device_name, snapshot)
+
+    return (chunk for chunk in chunks if chunk)
@@ -0,0 +1,211 @@
+###############################################################################
+#  handles.py for archivist scour microservice                                #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Pool of open sane device handles."""
+import os
+from contextlib import contextmanager
+from threading import Event, Lock, RLock, Thread
+from time import monotonic
+from typing import Callable, Dict, Iterator, List
+import sane
+
+SaneException = sane._sane.error
+
+HANDLE_IDLE_TTL = float(os.environ.get('SCOUR_HANDLE_IDLE_TTL', 900))
+HANDLE_PROBE_INTERVAL = float(os.environ.get('SCOUR_HANDLE_PROBE_INTERVAL',
+                                             60))
+HANDLE_WAIT = float(os.environ.get('SCOUR_HANDLE_WAIT', 10))
+PREWARM_DEVICES = [name for name in
+                   os.environ.get('SCOUR_PREWARM_DEVICES', '').split(',')
+                   if name]
+
+
+class HandleBusy(Exception):
+    """Raised when a handle stays in use longer than the pool waits."""
+
+
+class _Handle():
+    """A pooled handle and its bookkeeping."""
+
+    def __init__(self) -> None:
+        """Initialize an empty, closed handle."""
+        self.dev = None
+        self.broken = False
+        self.last_used = monotonic()
+        self.lock = RLock()
+
+
+class HandlePool():
+    """Keep sane handles open between operations.
+
+    Handles are opened on first use (or pre-warmed), probed while idle,
+    reopened before the next operation when they are found broken and
+    closed once they have been idle longer than the idle ttl, except
+    for pinned (pre-warmed) devices which are only probed. Callers
+    wait at most wait seconds for a handle another thread holds.
+    """
+
+    def __init__(self, opener: Callable = sane.open,
+                 idle_ttl: float = HANDLE_IDLE_TTL,
+                 probe_interval: float = HANDLE_PROBE_INTERVAL,
+                 wait: float = HANDLE_WAIT) -> None:
+        """Initialize the pool."""
+        self.opener = opener
+        self.idle_ttl = idle_ttl
+        self.probe_interval = probe_interval
+        self.wait = wait
+        self._pinned = set()
+        self._handles: Dict[str, _Handle] = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def open(self, name: str) -> None:
+        """Make sure a usable handle for the device is open."""
+        with self.use(name):
+            pass
+
+    def pin(self, name: str) -> None:
+        """Open a device's handle and keep it open while it is idle."""
+        self.open(name)
+        with self._lock:
+            self._pinned.add(name)
+
+    def close(self, name: str) -> None:
+        """Close the handle of a device."""
+        with self._lock:
+            handle = self._handles.pop(name, None)
+
+        if handle is not None:
+            with handle.lock:
+                self._close(handle)
+
+    def close_all(self) -> None:
+        """Close every handle."""
+        for name in self.names():
+            self.close(name)
+
+    def discard(self, name: str) -> None:
+        """Mark a handle broken so it is reopened before its next use."""
+        with self._lock:
+            handle = self._handles.get(name)
+
+        if handle is not None:
+            handle.broken = True
+
+    def names(self) -> List[str]:
+        """Return the names of the pooled devices."""
+        with self._lock:
+            return list(self._handles)
+
+    @contextmanager
+    def use(self, name: str) -> Iterator[object]:
+        """Hold the device's handle exclusively, reopening it if needed."""
+        handle = self._lock_handle(name)
+        try:
+            if handle.dev is None or handle.broken:
+                self._close(handle)
+                handle.dev = self.opener(name)
+                handle.broken = False
+            yield handle.dev
+        finally:
+            handle.last_used = monotonic()
+            handle.lock.release()
+
+    def start(self) -> None:
+        """Start the keep-alive thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, daemon=True,
+                                  name='scour-handles')
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the keep-alive thread and close every handle."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.close_all()
+
+    def maintain(self) -> None:
+        """Close handles idle past the ttl and probe the other idle ones."""
+        now = monotonic()
+        with self._lock:
+            handles = list(self._handles.items())
+
+        for name, handle in handles:
+            # A handle in use is healthy enough, never wait on a scan
+            if not handle.lock.acquire(blocking=False):
+                continue
+            try:
+                idle = now - handle.last_used
+                if idle >= self.idle_ttl and name not in self._pinned:
+                    self._close(handle)
+                    with self._lock:
+                        if self._handles.get(name) is handle:
+                            del self._handles[name]
+                elif idle >= self.probe_interval:
+                    self._probe(name, handle)
+            finally:
+                handle.lock.release()
+
+    def _lock_handle(self, name: str) -> _Handle:
+        """Return the locked pool entry of a device, creating it if needed."""
+        deadline = monotonic() + self.wait
+        while True:
+            with self._lock:
+                handle = self._handles.setdefault(name, _Handle())
+            if not handle.lock.acquire(
+                    timeout=max(0.0, deadline - monotonic())):
+                raise HandleBusy(f"Device {name} is in use.")
+            with self._lock:
+                if self._handles.get(name) is handle:
+                    return handle
+            # Closed for idleness while we waited, start over
+            handle.lock.release()
+
+    def _run(self) -> None:
+        """Keep-alive loop."""
+        while not self._stop.wait(self.probe_interval):
+            self.maintain()
+
+    def _probe(self, name: str, handle: _Handle) -> None:
+        """Check an idle handle and reopen it if the check fails."""
+        try:
+            if handle.dev is None or handle.broken:
+                raise SaneException("Handle not open")
+            handle.dev.get_parameters()
+        except SaneException:
+            self._close(handle)
+            try:
+                handle.dev = self.opener(name)
+                handle.broken = False
+            except SaneException:
+                # Leave it closed, the next use will try again
+                handle.broken = True
+
+    @staticmethod
+    def _close(handle: _Handle) -> None:
+        """Close a handle ignoring errors from an already dead one."""
+        if handle.dev is not None:
+            try:
+                handle.dev.close()
+            except SaneException:
+                pass
+            handle.dev = None
+
+
+handles = HandlePool()
@@ -15,13 +15,20 @@
 ###############################################################################
 
 """Model for a scour scan job."""
-from base64 import b64encode
-from io import BytesIO
+from base64 import b64decode, b64encode
 from enum import IntEnum
-from typing import List
+from hashlib import blake2b
+from itertools import count
+from typing import Dict, List, Tuple
 from datetime import datetime
-from pydantic import BaseModel, Base64Bytes
+from pydantic import BaseModel, Base64Bytes, Field, PrivateAttr
 from PIL import Image
+from .dedup import DuplicateAction
+from .encoding import PageFormat, encode_image
+
+_job_serials = count()
+
+OptionValue = str | int | float | None
 
 
 class JobStatus(IntEnum):
@@ -32,20 +39,135 @@ class JobStatus(IntEnum):
     ERROR = 2
 
 
+class DeliveryStatus(BaseModel):
+    """Delivery progress of a job's pages to one output sink."""
+
+    sink: str
+    pending: int = 0
+    delivered: int = 0
+    failed: int = 0
+    last_error: str = ""
+
+
+class DuplicatePage(BaseModel):
+    """A sheet that duplicates an earlier page."""
+
+    position: int
+    job_number: int
+    page: int
+    similarity: float
+    dropped: bool
+
+
+class JobSummary(BaseModel):
+    """Lightweight view of a job's progress, without the pages."""
+
+    job_number: int
+    status: JobStatus
+    error: str = ""
+    page_count: int = 0
+    start_date: datetime
+    end_date: datetime | None = None
+
+
 class Job(BaseModel):
     """Model for a scan job."""
 
     job_number: int
     pages: List[Base64Bytes] = []
-    start_date: datetime = datetime.now()
-    end_date: datetime = None
+    start_date: datetime = Field(default_factory=datetime.now)
+    end_date: datetime | None = None
     status: JobStatus = JobStatus.STARTED
     error: str = ""
-    _pages: List[Image] = []
-
-    def add_pages(self, page: Image) -> None:
-        """Add pages to the job."""
-        self._pages.append(page)
-        buf = BytesIO()
-        page.save(buf, format='JPEG')
-        self.pages.append(b64encode(buf.getvalue()))
+    options: Dict[str, OptionValue] = {}
+    deliveries: List[DeliveryStatus] = []
+    page_format: PageFormat = PageFormat.JPEG
+    duplicate_action: DuplicateAction = DuplicateAction.OFF
+    duplicates: List[DuplicatePage] = []
+    _serial: int = PrivateAttr(default_factory=lambda: next(_job_serials))
+    _revision: int = 0
+
+    def revision(self) -> Tuple[int, int]:
+        """Return a key that changes whenever the job's content changes."""
+        return (self._serial, self._revision)
+
+    def summary(self) -> JobSummary:
+        """Return the job's progress without its pages."""
+        return JobSummary(job_number=self.job_number, status=self.status,
+                          error=self.error, page_count=len(self.pages),
+                          start_date=self.start_date, end_date=self.end_date)
+
+    def summary_revision(self) -> Tuple[int, int, int]:
+        """Return a key that changes whenever the summary changes."""
+        return (self._serial, self.status, len(self.pages))
+
+    def page_data(self, index: int) -> bytes:
+        """Return the encoded image of a page."""
+        return b64decode(self._page(index))
+
+    def page_etag(self, index: int) -> str:
+        """Return an entity tag for a page derived from its content."""
+        return f'"{blake2b(self._page(index), digest_size=16).hexdigest()}"'
+
+    def add_pages(self, page: Image) -> bytes:
+        """Add pages to the job and return the encoded page."""
+        return self.add_encoded_page(encode_image(page, self.page_format))
+
+    def add_encoded_page(self, data: bytes | memoryview
+                         ) -> bytes | memoryview:
+        """Add an already encoded page to the job."""
+        self.pages.append(b64encode(data))
+        self._revision += 1
+        return data
+
+    def add_duplicate(self, position: int, job_number: int, page: int,
+                      similarity: float) -> None:
+        """Record that the sheet at position in the feed duplicates a page."""
+        self.duplicates.append(DuplicatePage(
+            position=position, job_number=job_number, page=page,
+            similarity=similarity,
+            dropped=self.duplicate_action == DuplicateAction.DROP))
+        self._revision += 1
+
+    def delivery_queued(self, sink: str) -> None:
+        """Record a page queued for delivery to a sink."""
+        self._delivery(sink).pending += 1
+        self._revision += 1
+
+    def delivery_done(self, sink: str, error: str = "") -> None:
+        """Record the outcome of a page delivery to a sink."""
+        status = self._delivery(sink)
+        status.pending -= 1
+        if error:
+            status.failed += 1
+            status.last_error = error
+        else:
+            status.delivered += 1
+        self._revision += 1
+
+    def complete(self) -> None:
+        """Mark the job as completed."""
+        self.status = JobStatus.COMPLETED
+        self.end_date = datetime.now()
+        self._revision += 1
+
+    def fail(self, error: str) -> None:
+        """Mark the job as failed."""
+        self.status = JobStatus.ERROR
+        self.error = error
+        self.end_date = datetime.now()
+        self._revision += 1
+
+    def _page(self, index: int) -> bytes:
+        """Return the stored page at index, rejecting negative indexes."""
+        if index < 0:
+            raise IndexError(f"Page {index} not found.")
+        return self.pages[index]
+
+    def _delivery(self, sink: str) -> DeliveryStatus:
+        """Return the delivery status of a sink, creating it if needed."""
+        status = next((d for d in self.deliveries if d.sink == sink), None)
+        if status is None:
+            status = DeliveryStatus(sink=sink)
+            self.deliveries.append(status)
+        return status
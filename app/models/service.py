@@ -17,6 +17,7 @@
 from typing import List
 import sane
 from .device import Device
+from .handles import handles
 
 SaneException = sane._sane.error
 
@@ -32,6 +33,7 @@ class Service():
 
     def initialize(self) -> None:
         """Initialize sane service."""
+        handles.close_all()
         sane.exit()
 
         try:
@@ -53,6 +55,27 @@ class Service():
 
         return self.devices
 
+    def prewarm(self, device_names: List[str]) -> List[Device]:
+        """Enable the named devices ('*' for all) so their handles are open.
+
+        Their handles are pinned so they stay open through quiet
+        periods. Devices that fail to open are left disabled.
+        """
+        if not self.devices:
+            self.refresh_devices()
+
+        enabled = []
+        for dev in self.devices:
+            if '*' in device_names or dev.device_name in device_names:
+                try:
+                    dev.enable()
+                    handles.pin(dev.device_name)
+                    enabled.append(dev)
+                except SaneException:
+                    pass
+
+        return enabled
+
     def get_device(self, device_name: str) -> Device:
         """Get an available device device by name."""
         try:
@@ -0,0 +1,316 @@
+###############################################################################
+#  sinks.py for archivist scour microservice                                  #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Output sinks that receive finished pages as they are scanned."""
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Annotated, Dict, Iterable, List, Literal, Union
+import httpx
+from pydantic import BaseModel, Field
+from .export import page_name, safe_name
+from .job import Job
+
+SINK_WORKERS = int(os.environ.get('SCOUR_SINK_WORKERS', 4))
+SINK_RETRIES = int(os.environ.get('SCOUR_SINK_RETRIES', 5))
+SINK_BACKOFF = float(os.environ.get('SCOUR_SINK_BACKOFF', 0.5))
+SINK_MAX_BACKOFF = 30.0
+
+
+class SinkError(Exception):
+    """Raised when a sink is misconfigured or a delivery fails."""
+
+
+class DirectorySinkConfig(BaseModel):
+    """Deliver pages to a local or network mounted directory."""
+
+    kind: Literal['directory'] = 'directory'
+    name: str
+    path: str
+
+
+class S3SinkConfig(BaseModel):
+    """Deliver pages to an S3 compatible object store."""
+
+    kind: Literal['s3'] = 's3'
+    name: str
+    bucket: str
+    prefix: str = ""
+    endpoint_url: str | None = None
+    region: str | None = None
+    access_key: str | None = None
+    secret_key: str | None = Field(None, exclude=True)
+
+
+class WebhookSinkConfig(BaseModel):
+    """Deliver pages by posting them to an http endpoint."""
+
+    kind: Literal['webhook'] = 'webhook'
+    name: str
+    url: str
+    headers: Dict[str, str] = {}
+    timeout: float = 30.0
+
+
+SinkConfig = Annotated[Union[DirectorySinkConfig, S3SinkConfig,
+                             WebhookSinkConfig], Field(discriminator='kind')]
+
+
+class Page():
+    """A finished page on its way to the sinks.
+
+    Only the job's stored copy of the page is kept while it waits in the
+    queue, it is decoded when a sink asks for it.
+    """
+
+    __slots__ = ('device_name', 'job', 'index')
+
+    def __init__(self, device_name: str, job: Job, index: int) -> None:
+        """Initialize a page."""
+        self.device_name = device_name
+        self.job = job
+        self.index = index
+
+    @property
+    def data(self) -> bytes:
+        """Return the encoded page."""
+        return self.job.page_data(self.index)
+
+    @property
+    def content_type(self) -> str:
+        """Return the media type of the page."""
+        return self.job.page_format.content_type
+
+    @property
+    def key(self) -> str:
+        """Return the relative path or object key of the page."""
+        return f'{safe_name(self.device_name)}/' \
+            f'{page_name(self.job, self.index)}'
+
+
+class Sink():
+    """Base class of the output sinks."""
+
+    def __init__(self, config: SinkConfig) -> None:
+        """Initialize the sink."""
+        self.config = config
+
+    @property
+    def name(self) -> str:
+        """Return the sink name."""
+        return self.config.name
+
+    def deliver(self, page: Page) -> None:
+        """Deliver a page, raising on failure."""
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        """Release the sink's connections."""
+
+
+class DirectorySink(Sink):
+    """Write pages below a directory."""
+
+    def deliver(self, page: Page) -> None:
+        """Write the page to a temporary file then rename it into place."""
+        target = os.path.join(self.config.path, page.key)
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+
+        # The temporary file lives next to the target so the rename stays
+        # on one filesystem and readers never see a partial page
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(page.data)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+class S3Sink(Sink):
+    """Put pages into an S3 compatible bucket."""
+
+    def __init__(self, config: S3SinkConfig) -> None:
+        """Initialize the sink and its client."""
+        super().__init__(config)
+        try:
+            import boto3  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise SinkError("The s3 sink requires boto3.") from ex
+
+        self._client = boto3.client('s3', endpoint_url=config.endpoint_url,
+                                    region_name=config.region,
+                                    aws_access_key_id=config.access_key,
+                                    aws_secret_access_key=config.secret_key)
+
+    def deliver(self, page: Page) -> None:
+        """Upload the page."""
+        key = f'{self.config.prefix.strip("/")}/{page.key}' \
+            if self.config.prefix else page.key
+        self._client.put_object(Bucket=self.config.bucket, Key=key,
+                                Body=page.data,
+                                ContentType=page.content_type)
+
+    def close(self) -> None:
+        """Close the client's connection pool."""
+        self._client.close()
+
+
+class WebhookSink(Sink):
+    """Post pages to a url."""
+
+    def __init__(self, config: WebhookSinkConfig) -> None:
+        """Initialize the sink and its connection pool."""
+        super().__init__(config)
+        self._client = httpx.Client(timeout=config.timeout)
+
+    def deliver(self, page: Page) -> None:
+        """Post the page."""
+        headers = {**self.config.headers,
+                   'Content-Type': page.content_type,
+                   'X-Scour-Device': page.device_name,
+                   'X-Scour-Job': str(page.job.job_number),
+                   'X-Scour-Page': str(page.index),
+                   'X-Scour-Key': page.key}
+        response = self._client.post(self.config.url, content=page.data,
+                                     headers=headers)
+        response.raise_for_status()
+
+    def close(self) -> None:
+        """Close the connection pool."""
+        self._client.close()
+
+
+_SINK_TYPES = {'directory': DirectorySink,
+               's3': S3Sink,
+               'webhook': WebhookSink}
+
+
+def make_sink(config: SinkConfig) -> Sink:
+    """Return the sink for a sink configuration."""
+    return _SINK_TYPES[config.kind](config)
+
+
+class SinkDispatcher():
+    """Deliver pages to sinks from a bounded pool of workers.
+
+    Scans hold the sinks they deliver to. A retired sink is closed only
+    once no scan holds it and its queued pages have been delivered.
+    """
+
+    def __init__(self, workers: int = SINK_WORKERS,
+                 retries: int = SINK_RETRIES,
+                 backoff: float = SINK_BACKOFF) -> None:
+        """Initialize the dispatcher."""
+        self.retries = retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='scour-sink')
+        self._lock = Lock()
+        self._pending = 0
+        self._inflight: Dict[Sink, int] = {}
+        self._users: Dict[Sink, int] = {}
+        self._retired = set()
+
+    @property
+    def pending(self) -> int:
+        """Return the number of deliveries queued or in flight."""
+        return self._pending
+
+    def submit(self, sinks: List[Sink], page: Page) -> None:
+        """Queue a page for delivery to every sink."""
+        for sink in sinks:
+            with self._lock:
+                self._pending += 1
+                self._inflight[sink] = self._inflight.get(sink, 0) + 1
+                page.job.delivery_queued(sink.name)
+            self._executor.submit(self._deliver, sink, page)
+
+    def hold(self, sinks: Iterable[Sink]) -> None:
+        """Keep sinks open while a scan may still deliver to them."""
+        with self._lock:
+            for sink in sinks:
+                self._users[sink] = self._users.get(sink, 0) + 1
+
+    def release(self, sinks: Iterable[Sink]) -> None:
+        """Let go of held sinks, closing retired ones nobody else uses."""
+        with self._lock:
+            for sink in sinks:
+                self._users[sink] -= 1
+                if self._users[sink] == 0:
+                    del self._users[sink]
+            idle = self._idle_retired(sinks)
+
+        for sink in idle:
+            sink.close()
+
+    def retire(self, sinks: Iterable[Sink]) -> None:
+        """Close sinks that get no more pages once they are idle."""
+        with self._lock:
+            self._retired.update(sinks)
+            idle = self._idle_retired(sinks)
+
+        for sink in idle:
+            sink.close()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting pages and optionally wait for queued ones."""
+        self._executor.shutdown(wait=wait)
+
+    def _deliver(self, sink: Sink, page: Page) -> None:
+        """Deliver a page to a sink, retrying with exponential backoff."""
+        error = ""
+        for attempt in range(self.retries + 1):
+            try:
+                sink.deliver(page)
+                error = ""
+                break
+            except Exception as ex:  # pylint: disable=broad-except
+                error = f"{type(ex).__name__}: {str(ex)}"
+                if attempt < self.retries:
+                    delay = min(self.backoff * 2 ** attempt, SINK_MAX_BACKOFF)
+                    time.sleep(delay * random.uniform(0.5, 1.5))
+
+        with self._lock:
+            self._pending -= 1
+            page.job.delivery_done(sink.name, error)
+            self._inflight[sink] -= 1
+            if self._inflight[sink] == 0:
+                del self._inflight[sink]
+            idle = self._idle_retired([sink])
+
+        for retired in idle:
+            retired.close()
+
+    def _idle_retired(self, sinks: Iterable[Sink]) -> List[Sink]:
+        """Forget and return the retired sinks no longer in use.
+
+        The lock must be held.
+        """
+        idle = [sink for sink in set(sinks) if sink in self._retired
+                and sink not in self._inflight and sink not in self._users]
+        self._retired.difference_update(idle)
+        return idle
+
+
+dispatcher = SinkDispatcher()
@@ -0,0 +1,161 @@
+###############################################################################
+#  cache.py for archivist scour microservice                                  #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Pre-serialized, revision keyed JSON response cache."""
+
+import os
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from typing import Callable, Hashable, Iterable, Iterator, List
+import orjson
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+JSON_MEDIA_TYPE = 'application/json'
+CACHE_MAX_BYTES = int(os.environ.get('SCOUR_RESPONSE_CACHE_BYTES', 64 << 20))
+
+
+class CachedBody():
+    """A serialized response body and the revision it was built from."""
+
+    __slots__ = ('revision', 'body', 'etag')
+
+    def __init__(self, revision: Hashable, body: bytes) -> None:
+        """Initialize a cached body."""
+        self.revision = revision
+        self.body = body
+        self.etag = f'"{blake2b(body, digest_size=16).hexdigest()}"'
+
+
+class ResponseCache():
+    """LRU cache of serialized bodies keyed by object revision.
+
+    The cache is bounded both by entry count and by the total size of
+    the bodies it holds, bodies larger than max_bytes are never kept.
+    """
+
+    def __init__(self, max_entries: int = 512,
+                 max_bytes: int = CACHE_MAX_BYTES) -> None:
+        """Initialize the cache."""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    @property
+    def size(self) -> int:
+        """Return the total size of the cached bodies."""
+        return self._size
+
+    def get(self, key: Hashable, revision: Hashable,
+            producer: Callable[[], bytes], store: bool = True) -> CachedBody:
+        """Return the body for key, rebuilding it if revision changed.
+
+        With store false a rebuilt body is returned without caching it.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.revision == revision:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = CachedBody(revision, producer())
+
+        with self._lock:
+            self._discard(key)
+            if store and len(entry.body) <= self.max_bytes:
+                self._entries[key] = entry
+                self._size += len(entry.body)
+                while len(self._entries) > self.max_entries or \
+                        self._size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= len(evicted.body)
+
+        return entry
+
+    def invalidate(self, key: Hashable = None) -> None:
+        """Drop a single entry or, with no key, the whole cache."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._size = 0
+            else:
+                self._discard(key)
+
+    def _discard(self, key: Hashable) -> None:
+        """Drop an entry, the lock must be held."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.body)
+
+
+def dump_model(model: BaseModel) -> bytes:
+    """Serialize a model to JSON bytes."""
+    return orjson.dumps(model.model_dump(mode='json'))
+
+
+def dump_models(models: Iterable[BaseModel]) -> bytes:
+    """Serialize a list of models to JSON bytes."""
+    return orjson.dumps([m.model_dump(mode='json') for m in models])
+
+
+def _iter_joined(entries: List[CachedBody]) -> Iterator[bytes]:
+    """Yield already serialized JSON bodies as a JSON array."""
+    yield b'['
+    for index, entry in enumerate(entries):
+        yield b',' + entry.body if index else entry.body
+    yield b']'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Return true if an If-None-Match header matches etag."""
+    if not if_none_match:
+        return False
+
+    tags = [t.strip() for t in if_none_match.split(',')]
+    return '*' in tags or any(t.removeprefix('W/') == etag for t in tags)
+
+
+def cached_response(entry: CachedBody,
+                    if_none_match: str | None = None) -> Response:
+    """Return a json response for entry or a 304 if the client has it."""
+    headers = {'ETag': entry.etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=entry.body, media_type=JSON_MEDIA_TYPE,
+                    headers=headers)
+
+
+def joined_response(entries: List[CachedBody],
+                    if_none_match: str | None = None) -> Response:
+    """Return the bodies as one JSON array without copying them together.
+
+    The entity tag is derived from the tags of the bodies.
+    """
+    etag = blake2b(''.join(e.etag for e in entries).encode(),
+                   digest_size=16).hexdigest()
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if etag_matches(if_none_match, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+
+    return StreamingResponse(_iter_joined(entries),
+                             media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+response_cache = ResponseCache()
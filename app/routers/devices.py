@@ -13,23 +13,69 @@
 #  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
 #  GNU General Public License for more details.                               #
 ###############################################################################
-"""Device routes."""
+"""Device routes.
 
+Calls that need the device's sane handle run in a worker thread, the
+handle may be held by a scan and must not stall the event loop.
+"""
+
+import asyncio
+from datetime import datetime
 from typing import List
-from fastapi import APIRouter, HTTPException
-from app.models import service, Device, DeviceParameter, DeviceOption, Job
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from app.models import (service, Device, DeviceParameter, DeviceOption, Job,
+                        JobStatus, JobSummary)
 from app.models.device import DeviceNotEnabled, SaneException, DeviceBusy
+from app.models.admission import ScanDeferred
+from app.models.dedup import DuplicateAction
+from app.models.encoding import PageFormat
+from app.models.export import ArchiveFormat, export_jobs, safe_name
+from app.models.sinks import SinkConfig, SinkError
+from .cache import (response_cache, cached_response, dump_model, dump_models,
+                    etag_matches, joined_response, CachedBody)
 
 
 DevicesRouter = APIRouter(prefix='/devices', tags=['devices'])
 OptionValue = int | float | str
 
 
-@DevicesRouter.get('')
-async def get_devices() -> List[Device]:
+def devices_body() -> CachedBody:
+    """Return the cached serialized device list."""
+    devices = service.devices
+    revision = tuple((d.device_name, d.device_model, d.device_vendor,
+                      d.device_type, d.device_status) for d in devices)
+    return response_cache.get('devices', revision,
+                              lambda: dump_models(devices))
+
+
+def options_body(dev: Device) -> CachedBody:
+    """Return the cached serialized option list of a device."""
+    return response_cache.get(('options', dev.device_name),
+                              dev.options_revision(),
+                              lambda: dump_models(dev.options()))
+
+
+def job_body(dev: Device, job: Job) -> CachedBody:
+    """Return the serialized job, cached once it no longer changes."""
+    return response_cache.get(('job', dev.device_name, job.job_number),
+                              job.revision(), lambda: dump_model(job),
+                              store=job.status != JobStatus.STARTED)
+
+
+def job_summary_body(dev: Device, job: Job) -> CachedBody:
+    """Return the cached serialized summary of a job."""
+    return response_cache.get(('job-summary', dev.device_name,
+                               job.job_number),
+                              job.summary_revision(),
+                              lambda: dump_model(job.summary()))
+
+
+@DevicesRouter.get('', response_model=List[Device])
+async def get_devices(if_none_match: str | None = Header(None)) -> Response:
     """Return the list of available devices."""
     try:
-        return service.devices
+        return cached_response(devices_body(), if_none_match)
     except Exception as ex:
         raise HTTPException(500, str(ex)) from ex
 
@@ -39,51 +85,98 @@ async def get_device_parameters(device_name: str) -> DeviceParameter:
     """Return the devices parameters."""
     try:
         dev = service.get_device(device_name)
-        return dev.parameters()
+        return await asyncio.to_thread(dev.parameters)
     except StopIteration as ex:
         raise HTTPException(404, str(ex)) from ex
     except DeviceNotEnabled as ex:
         raise HTTPException(404, "Device not enabled.") from ex
+    except DeviceBusy as ex:
+        raise HTTPException(409, f"Device {device_name} is busy.") from ex
     except Exception as ex:
         raise HTTPException(500, str(ex)) from ex
 
 
-@DevicesRouter.get('/{device_name}/options')
-async def get_device_options(device_name: str) -> List[DeviceOption]:
+@DevicesRouter.get('/{device_name}/options',
+                   response_model=List[DeviceOption])
+async def get_device_options(device_name: str,
+                             if_none_match: str | None = Header(None)
+                             ) -> Response:
     """Return list of device options."""
     try:
         dev = service.get_device(device_name)
-        return dev.options()
+        return cached_response(await asyncio.to_thread(options_body, dev),
+                               if_none_match)
     except StopIteration as ex:
         raise HTTPException(404, f"Device {device_name} not found.") from ex
     except DeviceNotEnabled as ex:
         raise HTTPException(404, "Device not enabled.") from ex
+    except DeviceBusy as ex:
+        raise HTTPException(409, f"Device {device_name} is busy.") from ex
 
 
-@DevicesRouter.put('/{device_name}/options')
+@DevicesRouter.put('/{device_name}/options',
+                   response_model=List[DeviceOption])
 async def set_device_options(device_name: str, option_name: str,
-                             option_value: OptionValue) -> List[DeviceOption]:
+                             option_value: OptionValue) -> Response:
     """Set a list of options."""
     try:
         dev = service.get_device(device_name)
-        dev.set_option(option_name, option_value)
-        return dev.options()
+        await asyncio.to_thread(dev.set_option, option_name, option_value)
+        return cached_response(await asyncio.to_thread(options_body, dev))
     except StopIteration as ex:
         raise HTTPException(404, f"Device {device_name} not found.") from ex
     except DeviceNotEnabled as ex:
         raise HTTPException(404, "Device not enabled.") from ex
+    except DeviceBusy as ex:
+        raise HTTPException(409, f"Device {device_name} is busy.") from ex
     except SaneException as ex:
         raise HTTPException(500, f"Internal server error: {str(ex)}") from ex
     except AttributeError as ex:
         raise HTTPException(403, f"Error setting option: {str(ex)}") from ex
 
 
+@DevicesRouter.get('/{device_name}/sinks')
+async def get_sinks(device_name: str) -> List[SinkConfig]:
+    """Return the output sinks attached to the device."""
+    try:
+        dev = service.get_device(device_name)
+        return dev.sinks()
+    except StopIteration as ex:
+        raise HTTPException(404, f"Device {device_name} not found.") from ex
+
+
+@DevicesRouter.put('/{device_name}/sinks')
+async def add_sink(device_name: str, sink: SinkConfig) -> List[SinkConfig]:
+    """Attach an output sink to the device."""
+    try:
+        dev = service.get_device(device_name)
+        return dev.add_sink(sink)
+    except StopIteration as ex:
+        raise HTTPException(404, f"Device {device_name} not found.") from ex
+    except SinkError as ex:
+        raise HTTPException(400, str(ex)) from ex
+
+
+@DevicesRouter.delete('/{device_name}/sinks/{sink_name}')
+async def remove_sink(device_name: str, sink_name: str) -> List[SinkConfig]:
+    """Detach an output sink from the device."""
+    try:
+        dev = service.get_device(device_name)
+        return dev.remove_sink(sink_name)
+    except StopIteration as ex:
+        raise HTTPException(404, f"Sink {sink_name} not found.") from ex
+
+
 @DevicesRouter.put('/{device_name}/scan')
-async def scan(device_name: str) -> Job:
-    """Scan using a device."""
+async def scan(device_name: str,
+               sinks: List[SinkConfig] = Body(None),
+               page_format: PageFormat = PageFormat.JPEG,
+               duplicates: DuplicateAction = DuplicateAction.OFF) -> Job:
+    """Scan using a device, delivering pages to any extra sinks given."""
     try:
         dev = service.get_device(device_name)
-        job = dev.scan()
+        job = await asyncio.to_thread(dev.scan, sinks, page_format,
+                                      duplicates)
 
         return job
 
@@ -95,27 +188,37 @@ async def scan(device_name: str) -> Job:
         raise HTTPException(404,
                             f"Device {device_name} is not enabled.") from ex
     except DeviceBusy as ex:
-        raise HTTPException(400, f"Device {device_name} is busy.") from ex
+        raise HTTPException(409, f"Device {device_name} is busy.") from ex
+    except ScanDeferred as ex:
+        raise HTTPException(503, str(ex),
+                            headers={'Retry-After':
+                                     str(ex.retry_after)}) from ex
+    except SinkError as ex:
+        raise HTTPException(400, str(ex)) from ex
 
 
-@DevicesRouter.get('/{device_name}/jobs')
-async def get_jobs(device_name: str) -> List[Job]:
+@DevicesRouter.get('/{device_name}/jobs', response_model=List[Job])
+async def get_jobs(device_name: str,
+                   if_none_match: str | None = Header(None)) -> Response:
     """Return the list of currently available jobs run by the device."""
     try:
         dev = service.get_device(device_name)
-        return dev._jobs
+        return joined_response([job_body(dev, job)
+                                for job in list(dev._jobs)], if_none_match)
     except StopIteration as ex:
         raise HTTPException(404, f"Device {device_name} not found.") from ex
     except DeviceNotEnabled as ex:
         raise HTTPException(404, f"Device {device_name} is not enabled.") from ex
 
 
-@DevicesRouter.get('/{device_name}/jobs/{jobid}')
-async def get_job(device_name: str, jobid: int) -> Job:
+@DevicesRouter.get('/{device_name}/jobs/{jobid}', response_model=Job)
+async def get_job(device_name: str, jobid: int,
+                  if_none_match: str | None = Header(None)) -> Response:
     """Return a job on the device."""
     try:
         dev = service.get_device(device_name)
-        return dev.get_job(jobid)
+        return cached_response(job_body(dev, dev.get_job(jobid)),
+                               if_none_match)
     except StopIteration as ex:
         raise HTTPException(404, f"Device {device_name} not found.") from ex
     except SaneException as ex:
@@ -124,3 +227,64 @@ async def get_job(device_name: str, jobid: int) -> Job:
         raise HTTPException(404, f"Device {device_name} is not enabled.") from ex
     except IndexError as ex:
         raise HTTPException(404, f"Job {jobid} not found.") from ex
+
+
+@DevicesRouter.get('/{device_name}/jobs/{jobid}/status',
+                   response_model=JobSummary)
+async def get_job_status(device_name: str, jobid: int,
+                         if_none_match: str | None = Header(None)
+                         ) -> Response:
+    """Return the progress of a job without its pages."""
+    try:
+        dev = service.get_device(device_name)
+        return cached_response(job_summary_body(dev, dev.get_job(jobid)),
+                               if_none_match)
+    except StopIteration as ex:
+        raise HTTPException(404, f"Device {device_name} not found.") from ex
+    except IndexError as ex:
+        raise HTTPException(404, f"Job {jobid} not found.") from ex
+
+
+@DevicesRouter.get('/{device_name}/jobs/{jobid}/pages/{page}',
+                   response_class=Response)
+async def get_page(device_name: str, jobid: int, page: int,
+                   if_none_match: str | None = Header(None)) -> Response:
+    """Return the encoded image of a job page."""
+    try:
+        dev = service.get_device(device_name)
+        job = dev.get_job(jobid)
+        etag = job.page_etag(page)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        return Response(content=job.page_data(page),
+                        media_type=job.page_format.content_type,
+                        headers=headers)
+    except StopIteration as ex:
+        raise HTTPException(404, f"Device {device_name} not found.") from ex
+    except IndexError as ex:
+        raise HTTPException(404,
+                            f"Job {jobid} page {page} not found.") from ex
+
+
+@DevicesRouter.get('/{device_name}/export')
+async def export(device_name: str,
+                 archive_format: ArchiveFormat = ArchiveFormat.ZIP,
+                 jobs: List[int] = Query(None), since: datetime = None,
+                 until: datetime = None) -> StreamingResponse:
+    """Stream an archive of jobs selected by id and/or start date."""
+    try:
+        dev = service.get_device(device_name)
+        selected = dev.find_jobs(jobs, since, until)
+    except StopIteration as ex:
+        raise HTTPException(404, f"Device {device_name} not found.") from ex
+    except IndexError as ex:
+        raise HTTPException(404, "Job not found.") from ex
+
+    filename = f"{safe_name(device_name)}-jobs.{archive_format.value}"
+    return StreamingResponse(
+        export_jobs(device_name, selected, archive_format),
+        media_type=archive_format.media_type,
+        headers={'Content-Disposition':
+                 f'attachment; filename="{filename}"'})
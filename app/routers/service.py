@@ -15,9 +15,13 @@
 ###############################################################################
 """Backend service routes."""
 
+import asyncio
 from typing import Union, List
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Response
 from app.models import service, Device, SaneException
+from app.models.device import DeviceBusy
+from .cache import cached_response
+from .devices import devices_body
 
 ServiceRouter = APIRouter(prefix='/service', tags=['service'])
 
@@ -31,11 +35,11 @@ async def get_service():
         raise HTTPException(500, str(ex)) from ex
 
 
-@ServiceRouter.get('/devices')
-async def devices():
+@ServiceRouter.get('/devices', response_model=List[Device])
+async def devices(if_none_match: str | None = Header(None)) -> Response:
     """Get a list of devices through sane."""
     try:
-        return service.devices
+        return cached_response(devices_body(), if_none_match)
     except Exception as ex:
         raise HTTPException(500, str(ex)) from ex
 
@@ -54,10 +58,12 @@ async def enable_device(device_name: str) -> Device:
     """Return an enabled device."""
     try:
         dev = service.get_device(device_name)
-        dev.enable()
+        await asyncio.to_thread(dev.enable)
         return dev
     except StopIteration as ex:
         raise HTTPException(404, f"Device {device_name} not found.") from ex
+    except DeviceBusy as ex:
+        raise HTTPException(409, f"Device {device_name} is busy.") from ex
     except SaneException as ex:
         raise HTTPException(500, f"Internal Sane Exception: {str(ex)}") from ex
 
@@ -67,10 +73,12 @@ async def disable_device(device_name: str) -> Device:
     """Disable an available enabled scanning device."""
     try:
         dev: Device = service.get_device(device_name)
-        dev.disable()
+        await asyncio.to_thread(dev.disable)
         return dev
     except StopIteration as ex:
         raise HTTPException(404, f"Device {device_name} not found.") from ex
+    except DeviceBusy as ex:
+        raise HTTPException(409, f"Device {device_name} is busy.") from ex
     except SaneException as ex:
         raise HTTPException(500, f"Internal Sane Exception: {str(ex)}") from ex
 
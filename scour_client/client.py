@@ -0,0 +1,265 @@
+###############################################################################
+#  client.py for archivist scour microservice                                 #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Async client for the scour service."""
+import asyncio
+from datetime import datetime
+from enum import IntEnum
+from typing import Any, Dict, List
+from urllib.parse import quote
+import httpx
+
+CHUNK_SIZE = 1 << 16
+
+
+class JobStatus(IntEnum):
+    """Scan job statuses."""
+
+    STARTED = 0
+    COMPLETED = 1
+    ERROR = 2
+
+
+class ScourError(Exception):
+    """Raised when the service answers with an error."""
+
+    def __init__(self, status_code: int, detail: str,
+                 retry_after: float = None) -> None:
+        """Initialize the error."""
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class ScourClient():
+    """Async client mirroring the service and devices routes.
+
+    One pooled keep-alive connection set is shared by every call, so
+    operations on several devices can run concurrently. Pass an
+    httpx.ASGITransport as transport to talk to the app in-process.
+    """
+
+    def __init__(self, base_url: str, *, max_connections: int = 20,
+                 timeout: float = 30.0,
+                 transport: httpx.AsyncBaseTransport = None,
+                 **kwargs) -> None:
+        """Initialize the client."""
+        self._client = httpx.AsyncClient(
+            base_url=base_url, timeout=timeout, transport=transport,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            **kwargs)
+
+    async def __aenter__(self) -> 'ScourClient':
+        """Enter the client context."""
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        """Close the client on leaving the context."""
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        await self._client.aclose()
+
+    # Service routes
+
+    async def service_info(self) -> str:
+        """Return the sane version of the service."""
+        return await self._json('GET', '/service')
+
+    async def devices(self) -> List[Dict]:
+        """Return the devices known to the service."""
+        return await self._json('GET', '/service/devices')
+
+    async def device(self, device_name: str) -> Dict:
+        """Return a device."""
+        return await self._json('GET', f'/service/devices/{_q(device_name)}')
+
+    async def enable(self, device_name: str) -> Dict:
+        """Enable a device."""
+        return await self._json('PUT',
+                                f'/service/devices/{_q(device_name)}/enable')
+
+    async def disable(self, device_name: str) -> Dict:
+        """Disable a device."""
+        return await self._json('PUT',
+                                f'/service/devices/{_q(device_name)}/disable')
+
+    async def refresh_devices(self) -> List[Dict]:
+        """Rediscover the devices available to the service."""
+        return await self._json('GET', '/service/refresh_devices')
+
+    # Device routes
+
+    async def parameters(self, device_name: str) -> Dict:
+        """Return the parameters of a device."""
+        return await self._json('GET',
+                                f'/devices/{_q(device_name)}/parameters')
+
+    async def options(self, device_name: str) -> List[Dict]:
+        """Return the options of a device."""
+        return await self._json('GET', f'/devices/{_q(device_name)}/options')
+
+    async def set_option(self, device_name: str, option_name: str,
+                         option_value: int | float | str) -> List[Dict]:
+        """Set a device option and return the updated options."""
+        return await self._json('PUT', f'/devices/{_q(device_name)}/options',
+                                params={'option_name': option_name,
+                                        'option_value': option_value})
+
+    async def sinks(self, device_name: str) -> List[Dict]:
+        """Return the output sinks of a device."""
+        return await self._json('GET', f'/devices/{_q(device_name)}/sinks')
+
+    async def add_sink(self, device_name: str, sink: Dict) -> List[Dict]:
+        """Attach an output sink to a device."""
+        return await self._json('PUT', f'/devices/{_q(device_name)}/sinks',
+                                json=sink)
+
+    async def remove_sink(self, device_name: str,
+                          sink_name: str) -> List[Dict]:
+        """Detach an output sink from a device."""
+        return await self._json(
+            'DELETE', f'/devices/{_q(device_name)}/sinks/{_q(sink_name)}')
+
+    async def scan(self, device_name: str, sinks: List[Dict] = None,
+                   page_format: str = 'jpeg',
+                   duplicates: str = 'off') -> Dict:
+        """Start a scan and return the new job."""
+        return await self._json('PUT', f'/devices/{_q(device_name)}/scan',
+                                params={'page_format': page_format,
+                                        'duplicates': duplicates},
+                                json=sinks)
+
+    async def jobs(self, device_name: str) -> List[Dict]:
+        """Return the jobs of a device."""
+        return await self._json('GET', f'/devices/{_q(device_name)}/jobs')
+
+    async def job(self, device_name: str, jobid: int) -> Dict:
+        """Return a job."""
+        return await self._json('GET',
+                                f'/devices/{_q(device_name)}/jobs/{jobid}')
+
+    async def job_status(self, device_name: str, jobid: int) -> Dict:
+        """Return the progress of a job without its pages."""
+        return await self._json(
+            'GET', f'/devices/{_q(device_name)}/jobs/{jobid}/status')
+
+    async def scan_and_wait(self, device_name: str,
+                            sinks: List[Dict] = None,
+                            page_format: str = 'jpeg',
+                            duplicates: str = 'off',
+                            timeout: float = None,
+                            min_interval: float = 0.25,
+                            max_interval: float = 2.0) -> Dict:
+        """Start a scan and return its job once it has finished.
+
+        Only the job's pageless status is polled, revalidated with its
+        ETag so polls while nothing changes are answered with an empty
+        304 and the interval backs off. The full job is fetched once.
+        """
+        job = await self.scan(device_name, sinks, page_format, duplicates)
+        jobid = job['job_number']
+        url = f'/devices/{_q(device_name)}/jobs/{jobid}/status'
+        status = job
+        etag = None
+        interval = min_interval
+
+        async with asyncio.timeout(timeout):
+            while status['status'] == JobStatus.STARTED:
+                await asyncio.sleep(interval)
+                headers = {'If-None-Match': etag} if etag else {}
+                response = await self._client.get(url, headers=headers)
+                if response.status_code == 304:
+                    interval = min(interval * 2, max_interval)
+                    continue
+
+                _raise_for_status(response)
+                status = response.json()
+                etag = response.headers.get('ETag')
+                interval = min_interval
+
+        return await self.job(device_name, jobid)
+
+    async def scan_many(self, device_names: List[str],
+                        **kwargs) -> Dict[str, Dict]:
+        """Scan on several devices at once and wait for every job."""
+        jobs = await asyncio.gather(*(self.scan_and_wait(name, **kwargs)
+                                      for name in device_names))
+        return dict(zip(device_names, jobs))
+
+    async def download_page(self, device_name: str, jobid: int, page: int,
+                            path: str) -> int:
+        """Stream a page image to a file and return its size."""
+        return await self._download(
+            f'/devices/{_q(device_name)}/jobs/{jobid}/pages/{page}', path)
+
+    async def export(self, device_name: str, path: str,
+                     archive_format: str = 'zip', jobs: List[int] = None,
+                     since: datetime = None, until: datetime = None) -> int:
+        """Stream an archive of jobs to a file and return its size."""
+        params = {'archive_format': archive_format}
+        if jobs:
+            params['jobs'] = jobs
+        if since:
+            params['since'] = since.isoformat()
+        if until:
+            params['until'] = until.isoformat()
+
+        return await self._download(f'/devices/{_q(device_name)}/export',
+                                    path, params=params)
+
+    async def _json(self, method: str, url: str, **kwargs) -> Any:
+        """Send a request and return its decoded JSON body."""
+        response = await self._client.request(method, url, **kwargs)
+        _raise_for_status(response)
+        return response.json()
+
+    async def _download(self, url: str, path: str, **kwargs) -> int:
+        """Stream a response body into a file."""
+        size = 0
+        async with self._client.stream('GET', url, **kwargs) as response:
+            if response.is_error:
+                await response.aread()
+                _raise_for_status(response)
+
+            with open(path, 'wb') as out:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    out.write(chunk)
+                    size += len(chunk)
+
+        return size
+
+
+def _q(segment: str) -> str:
+    """Quote a path segment, device names contain ':' and ';'."""
+    return quote(segment, safe='')
+
+
+def _raise_for_status(response: httpx.Response) -> None:
+    """Raise a ScourError for error responses."""
+    if response.is_error:
+        try:
+            body = response.json()
+            detail = body.get('detail', body) if isinstance(body, dict) \
+                else body
+        except ValueError:
+            detail = response.text
+        retry_after = response.headers.get('Retry-After')
+        raise ScourError(response.status_code, str(detail),
+                         float(retry_after) if retry_after and
+                         retry_after.isdigit() else None)
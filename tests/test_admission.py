@@ -0,0 +1,104 @@
+###############################################################################
+#  test_admission.py for archivist scour microservice                         #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for admission control."""
+import pytest
+from app.models import admission as admission_module
+from app.models.admission import (AdmissionController, ScanDeferred,
+                                  memory_limit, physical_memory)
+
+
+def make_controller(depth: int = 0, rss: int = 0,
+                    pooled: int = 0) -> AdmissionController:
+    """Return a controller with fixed queue depth and memory use."""
+    return AdmissionController(max_inflight_bytes=100, max_queue_depth=4,
+                               max_rss=1000, queue_depth=lambda: depth,
+                               rss=lambda: rss, pooled=lambda: pooled)
+
+
+def test_admit_inflight_pages():
+    """
+    GIVEN raw pages waiting to be encoded
+    WHEN a scan that would exceed the in flight limit is admitted
+    SHOULD defer it until the pages are encoded.
+    """
+    controller = make_controller()
+
+    with controller.page(80):
+        controller.admit(10)
+        with pytest.raises(ScanDeferred) as deferred:
+            controller.admit(50)
+
+    controller.admit(50)
+    assert controller.inflight_bytes == 0
+    assert deferred.value.retry_after > 0
+
+
+def test_admit_backlog_and_memory():
+    """
+    GIVEN a long delivery queue, high memory use or many pooled buffers
+    WHEN a scan is admitted
+    SHOULD defer it.
+    """
+    with pytest.raises(ScanDeferred):
+        make_controller(depth=5).admit()
+    with pytest.raises(ScanDeferred):
+        make_controller(rss=900).admit(200)
+
+    make_controller(depth=4, rss=900).admit(50)
+    with pytest.raises(ScanDeferred):
+        make_controller(pooled=80).admit(50)
+
+
+def test_throttle_gives_up():
+    """
+    GIVEN pressure that does not clear
+    WHEN a scan is throttled between pages
+    SHOULD give up after the timeout.
+    """
+    assert not make_controller(depth=5).throttle(timeout=0.05)
+    assert make_controller().throttle(timeout=0.05)
+
+
+def test_admit_reserves_first_page():
+    """
+    GIVEN a burst of scans admitted before any has read a page
+    WHEN the reservations would exceed the in flight limit
+    SHOULD defer the later scans until a reservation is used or returned.
+    """
+    controller = make_controller()
+
+    reserved = controller.admit(60)
+    with pytest.raises(ScanDeferred):
+        controller.admit(60)
+
+    with controller.page(60, reserved):
+        assert controller.reserved_bytes == 0
+        assert controller.inflight_bytes == 60
+    controller.release(controller.admit(60))
+
+    assert controller.reserved_bytes == 0
+    controller.admit(60)
+
+
+def test_memory_limit_without_cgroup(monkeypatch):
+    """
+    GIVEN no cgroup memory limit
+    WHEN the memory limit is read
+    SHOULD fall back to the physical memory.
+    """
+    monkeypatch.setattr(admission_module, '_CGROUP_LIMITS', ['/nonexistent'])
+
+    assert memory_limit() == physical_memory() > 0
@@ -0,0 +1,68 @@
+###############################################################################
+#  test_buffers.py for archivist scour microservice                           #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for the page buffer pool."""
+from io import BytesIO
+from app.models.buffers import BufferPool
+from app.models.encoding import PageFormat, RawFrame, encode_frame
+from PIL import Image
+
+
+def test_buffers_recycled():
+    """
+    GIVEN a pool with a reserved buffer
+    WHEN buffers of that shape are borrowed in turn
+    SHOULD hand out the same array every time.
+    """
+    pool = BufferPool()
+    pool.reserve((4, 5, 4))
+    with pool.borrow((4, 5, 4)) as first:
+        pass
+    with pool.borrow((4, 5, 4)) as second:
+        assert pool.idle_bytes == 0
+
+    assert first is second
+    assert pool.idle_bytes == pool.pooled_bytes == first.nbytes
+
+    pool.clear()
+    assert pool.pooled_bytes == 0
+
+
+def test_buffer_pool_limit():
+    """
+    GIVEN a pool smaller than a buffer
+    WHEN the buffer is released
+    SHOULD not keep it.
+    """
+    pool = BufferPool(max_bytes=10)
+    pool.release(pool.acquire((4, 4)))
+
+    assert pool.idle_bytes == 0
+
+
+def test_frame_array_is_a_view():
+    """
+    GIVEN a raw RGB frame
+    WHEN viewed as an array and encoded to JPEG
+    SHOULD share the frame memory and keep the page size.
+    """
+    image = Image.open('tests/data/lorem1.png').convert('RGB')
+    frame = RawFrame(bytearray(image.tobytes()), image.width, image.height,
+                     3)
+    frame.array()[0, 0] = (1, 2, 3)
+
+    assert frame.data[:3] == b'\x01\x02\x03'
+    assert Image.open(BytesIO(encode_frame(frame, PageFormat.JPEG))).size \
+        == image.size
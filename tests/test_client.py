@@ -0,0 +1,131 @@
+###############################################################################
+#  test_client.py for archivist scour microservice                            #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for the async client against the in-process app."""
+import asyncio
+import httpx
+import pytest
+from app.main import app
+from app.models import service, Device, Job
+from PIL import Image
+from scour_client import ScourClient, ScourError
+
+DEVICE_NAME = "brother4:net1;dev0"
+
+
+@pytest.fixture(name='device')
+def fixture_device(monkeypatch):
+    """Register a device holding one completed job."""
+    device = Device(device_name=DEVICE_NAME, device_model="Brother",
+                    device_vendor="*Brother", device_type="L2700DW")
+    job = Job(job_number=0)
+    job.add_pages(Image.open('tests/data/lorem1.png'))
+    job.complete()
+    device._jobs = [job]
+    monkeypatch.setattr(service, 'devices', [device])
+    return device
+
+
+def make_client() -> ScourClient:
+    """Return a client talking to the app in-process."""
+    return ScourClient('http://scour',
+                       transport=httpx.ASGITransport(app=app))
+
+
+def test_client_jobs(device):
+    """
+    GIVEN a device with a completed job
+    WHEN the jobs are listed and fetched through the client
+    SHOULD return the job.
+    """
+    async def run():
+        async with make_client() as client:
+            devices = await client.devices()
+            jobs = await client.jobs(DEVICE_NAME)
+            job = await client.job(DEVICE_NAME, 0)
+            with pytest.raises(ScourError) as err:
+                await client.job(DEVICE_NAME, 5)
+        return devices, jobs, job, err.value
+
+    devices, jobs, job, err = asyncio.run(run())
+
+    assert devices[0]['device_name'] == DEVICE_NAME
+    assert jobs == [job]
+    assert len(job['pages']) == 1
+    assert err.status_code == 404
+
+
+def test_client_download_page(device, tmp_path):
+    """
+    GIVEN a device with a completed job
+    WHEN a page is downloaded
+    SHOULD write the encoded image to the file.
+    """
+    path = tmp_path / 'page.jpg'
+
+    async def run():
+        async with make_client() as client:
+            return await client.download_page(DEVICE_NAME, 0, 0, str(path))
+
+    size = asyncio.run(run())
+
+    assert path.read_bytes() == device.get_job(0).page_data(0)
+    assert size == path.stat().st_size
+
+
+def test_client_scan_and_wait(device, monkeypatch):
+    """
+    GIVEN a device whose scan finishes after a few polls
+    WHEN the client scans and waits
+    SHOULD poll the pageless status and fetch the full job once.
+    """
+    job = Job(job_number=1)
+    monkeypatch.setattr(Device, 'scan', lambda self, *args: job)
+    device._jobs.append(job)
+    requested = []
+
+    async def log(request):
+        requested.append(request.url.path)
+        if len(requested) == 4:
+            job.add_pages(Image.open('tests/data/lorem1.png'))
+            job.complete()
+
+    async def run():
+        async with make_client() as client:
+            client._client.event_hooks['request'].append(log)
+            return await client.scan_and_wait(DEVICE_NAME, min_interval=0.01)
+
+    result = asyncio.run(run())
+
+    assert result['status'] == 1
+    assert len(result['pages']) == 1
+    assert all(path.endswith('/jobs/1/status') for path in requested[1:-1])
+    assert requested[-1].endswith('/jobs/1')
+
+
+def test_page_etag_follows_content():
+    """
+    GIVEN two jobs with the same number but different pages
+    WHEN their page etags are compared
+    SHOULD differ, and negative pages are not found.
+    """
+    first, second = Job(job_number=0), Job(job_number=0)
+    first.add_pages(Image.open('tests/data/lorem1.png'))
+    second.add_encoded_page(b'other page')
+
+    assert first.page_etag(0) != second.page_etag(0)
+    assert first.page_etag(0) == first.page_etag(0)
+    with pytest.raises(IndexError):
+        first.page_data(-1)
@@ -0,0 +1,75 @@
+###############################################################################
+#  test_dedup.py for archivist scour microservice                             #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for duplicate page detection."""
+import numpy as np
+from app.models.dedup import DuplicateDetector, HashIndex, phash
+from PIL import Image
+
+
+def page() -> np.ndarray:
+    """Return the test page as an RGB array."""
+    return np.asarray(Image.open('tests/data/lorem1.png').convert('RGB'))
+
+
+def test_refed_page_detected():
+    """
+    GIVEN a detector holding a page
+    WHEN the same sheet comes back a little darker
+    SHOULD match it, while a different page should not.
+    """
+    detector = DuplicateDetector(threshold=0.9)
+    page_hash, match = detector.check(page())
+    assert match is None
+    detector.add(page_hash, 3, 0)
+
+    _, refed = detector.check((page() * 0.9).astype(np.uint8))
+    blocks = np.random.default_rng(0).integers(0, 255, (16, 16, 3),
+                                               dtype=np.uint8)
+    _, other = detector.check(blocks.repeat(64, axis=0).repeat(64, axis=1))
+
+    assert refed[1:] == (3, 0)
+    assert other is None
+
+
+def test_device_window():
+    """
+    GIVEN a page indexed in the device window by an earlier job
+    WHEN a new job's detector sees it again
+    SHOULD match the earlier job's page.
+    """
+    window = HashIndex(capacity=2)
+    DuplicateDetector(window=window).add(phash(page()), 1, 4)
+
+    _, match = DuplicateDetector(window=window).check(page())
+
+    assert match == (0, 1, 4)
+
+
+def test_small_page_unhashable():
+    """
+    GIVEN a page smaller than the hash grid
+    WHEN it is checked and added
+    SHOULD have no hash and never match.
+    """
+    detector = DuplicateDetector()
+    small = np.zeros((20, 20, 3), np.uint8)
+
+    page_hash, match = detector.check(small)
+    detector.add(page_hash, 0, 0)
+
+    assert page_hash is None
+    assert match is None
+    assert detector.check(small) == (None, None)
@@ -14,8 +14,12 @@
 #  GNU General Public License for more details.                               #
 ###############################################################################
 """Unit tests for device model."""
-from app.models import Device
-from app.models import Job
+from threading import Event, Thread
+import pytest
+from app.models import device as device_module
+from app.models import Device, DeviceOption
+from app.models import Job, JobStatus
+from app.models.device import DevStatus, DeviceBusy
 from PIL import Image
 
 
@@ -44,3 +48,98 @@ def test_job_pages():
     job.add_pages(Image.open('tests/data/lorem1.png'))
 
     job.model_dump()
+
+
+def test_running_job_summary():
+    """
+    GIVEN a job that is still running
+    WHEN its summary is taken
+    SHOULD have no end date.
+    """
+    job = Job(job_number=1)
+    job.add_encoded_page(b'page')
+
+    summary = job.summary()
+
+    assert summary.end_date is None
+    assert summary.page_count == 1
+
+
+def test_find_jobs_negative_id():
+    """
+    GIVEN a device with a job
+    WHEN jobs are looked up with a negative id
+    SHOULD raise IndexError instead of returning the last job.
+    """
+    device = Device(device_name="brother4:net1;dev0",
+                    device_model="Brother",
+                    device_vendor="*Brother",
+                    device_type="L2700DW")
+    device._jobs.append(Job(job_number=0))
+
+    with pytest.raises(IndexError):
+        device.find_jobs([-1])
+
+
+def test_failed_scan_leaves_final_state(monkeypatch):
+    """
+    GIVEN a scan whose acquisition fails with a non sane error
+    WHEN the scan thread runs
+    SHOULD fail the job and put the device in error instead of scanning.
+    """
+    def acquire_frames(hold, adf):
+        raise RuntimeError("Scanner returned no data")
+        yield
+
+    monkeypatch.setattr(device_module, 'acquire_frames', acquire_frames)
+    monkeypatch.setattr(Device, '_reserve_buffers', lambda self, job: None)
+    device = Device(device_name="brother4:net1;dev0",
+                    device_model="Brother",
+                    device_vendor="*Brother",
+                    device_type="L2700DW",
+                    device_status=DevStatus.IDLE)
+    device._options = [DeviceOption(name='source', description='', active=True,
+                                    value='Flatbed', py_name='source',
+                                    option_type=3, unit=0, size=0, cap=0,
+                                    constraint=None)]
+    job = Job(job_number=0)
+
+    with pytest.raises(RuntimeError):
+        device._start_scan(job, [])
+
+    assert device.device_status == DevStatus.ERROR
+    assert job.status == JobStatus.ERROR
+    assert job.error == "Scanner returned no data"
+
+
+def test_concurrent_scans_claim_device(monkeypatch):
+    """
+    GIVEN a scan that is still starting up
+    WHEN a second scan is requested on the same device
+    SHOULD refuse it as busy instead of starting another job.
+    """
+    device = Device(device_name="brother4:net1;dev0",
+                    device_model="Brother",
+                    device_vendor="*Brother",
+                    device_type="L2700DW",
+                    device_status=DevStatus.IDLE)
+    started, finish = Event(), Event()
+
+    def slow_frame_size(self):
+        started.set()
+        finish.wait()
+        return 0
+
+    monkeypatch.setattr(Device, '_frame_size', slow_frame_size)
+    monkeypatch.setattr(Device, 'options', lambda self: [])
+    monkeypatch.setattr(Device, '_start_scan', lambda self, *args: None)
+    first = Thread(target=device.scan)
+    first.start()
+    started.wait()
+
+    with pytest.raises(DeviceBusy):
+        device.scan()
+
+    finish.set()
+    first.join()
+    assert len(device._jobs) == 1
@@ -0,0 +1,40 @@
+###############################################################################
+#  test_encoding.py for archivist scour microservice                          #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for strip-wise page encoding."""
+from io import BytesIO
+import pytest
+from app.models.encoding import PageFormat, RawFrame, encode_frame
+from PIL import Image
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+@pytest.mark.parametrize('page_format', [PageFormat.PNG, PageFormat.TIFF])
+def test_encode_frame_lossless(mode, page_format):
+    """
+    GIVEN a raw frame
+    WHEN encoded band by band to a lossless format
+    SHOULD decode to the original pixels.
+    """
+    image = Image.open('tests/data/lorem1.png').convert(mode)
+    frame = RawFrame(bytearray(image.tobytes()), image.width, image.height,
+                     len(mode))
+
+    decoded = Image.open(BytesIO(encode_frame(frame, page_format,
+                                              band_lines=37)))
+
+    assert decoded.mode == mode
+    assert decoded.size == image.size
+    assert decoded.tobytes() == image.tobytes()
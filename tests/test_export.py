@@ -0,0 +1,60 @@
+###############################################################################
+#  test_export.py for archivist scour microservice                            #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for job export."""
+import json
+import tarfile
+import zipfile
+from io import BytesIO
+from app.models import Job
+from app.models.export import ArchiveFormat, export_jobs, MANIFEST_NAME
+from PIL import Image
+
+
+def make_job(job_number: int) -> Job:
+    """Return a completed job with a single page."""
+    job = Job(job_number=job_number, options={'source': 'Flatbed'})
+    job.add_pages(Image.open('tests/data/lorem1.png'))
+    job.complete()
+    return job
+
+
+def test_export_zip():
+    """
+    GIVEN two completed jobs
+    WHEN exported as a zip
+    SHOULD contain every page and a manifest with the option snapshots.
+    """
+    data = b''.join(export_jobs('dev', [make_job(0), make_job(1)],
+                                ArchiveFormat.ZIP))
+    archive = zipfile.ZipFile(BytesIO(data))
+    manifest = json.loads(archive.read(MANIFEST_NAME))
+
+    assert archive.namelist() == ['job-0000/page-0001.jpg',
+                                  'job-0001/page-0001.jpg', MANIFEST_NAME]
+    assert manifest['jobs'][1]['options'] == {'source': 'Flatbed'}
+    assert archive.read('job-0000/page-0001.jpg')[:2] == b'\xff\xd8'
+
+
+def test_export_tar():
+    """
+    GIVEN a completed job
+    WHEN exported as a tar
+    SHOULD contain the page and the manifest.
+    """
+    data = b''.join(export_jobs('dev', [make_job(0)], ArchiveFormat.TAR))
+    archive = tarfile.open(fileobj=BytesIO(data))
+
+    assert archive.getnames() == ['job-0000/page-0001.jpg', MANIFEST_NAME]
@@ -0,0 +1,79 @@
+###############################################################################
+#  test_gateway.py for archivist scour microservice                           #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for the federation gateway."""
+import asyncio
+import httpx
+from app.gateway import router, UpstreamRegistry
+from app.gateway.main import app as gateway_app
+from app.gateway.upstreams import GATEWAY_CONNECT_TIMEOUT, Upstream
+from app.main import app
+from app.models import service, Device, Job
+from PIL import Image
+
+DEVICE_NAME = "brother4:net1;dev0"
+
+
+def test_gateway_routes_to_upstream(monkeypatch):
+    """
+    GIVEN a gateway fronting one scour instance
+    WHEN devices are listed and a page is fetched through it
+    SHOULD qualify the device names and stream the page from the upstream.
+    """
+    device = Device(device_name=DEVICE_NAME, device_model="Brother",
+                    device_vendor="*Brother", device_type="L2700DW")
+    job = Job(job_number=0)
+    job.add_pages(Image.open('tests/data/lorem1.png'))
+    device._jobs = [job]
+    monkeypatch.setattr(service, 'devices', [device])
+
+    registry = UpstreamRegistry()
+    monkeypatch.setattr(router, 'registry', registry)
+
+    async def run():
+        await registry.add('office', 'http://office',
+                           transport=httpx.ASGITransport(app=app))
+        async with httpx.AsyncClient(
+                base_url='http://gateway',
+                transport=httpx.ASGITransport(app=gateway_app)) as client:
+            devices = (await client.get('/devices')).json()
+            qualified = await client.get(
+                f"/devices/{devices[0]['device_name']}/jobs/0/pages/0")
+            unqualified = await client.get(f"/devices/{DEVICE_NAME}/jobs/0")
+            missing = await client.get('/devices/nope/jobs')
+        await registry.aclose()
+        return devices, qualified, unqualified, missing
+
+    devices, qualified, unqualified, missing = asyncio.run(run())
+
+    assert devices[0]['device_name'] == f"{DEVICE_NAME}@office"
+    assert devices[0]['upstream'] == 'office'
+    assert qualified.content == job.page_data(0)
+    assert unqualified.json()['job_number'] == 0
+    assert missing.status_code == 404
+
+
+def test_upstream_connect_timeout():
+    """
+    GIVEN an upstream
+    WHEN its connection pool is created
+    SHOULD bound connecting but leave streamed bodies unbounded.
+    """
+    upstream = Upstream('site', 'http://scour')
+    timeout = upstream.client.timeout
+
+    assert timeout.connect == GATEWAY_CONNECT_TIMEOUT
+    assert timeout.read is None
+    asyncio.run(upstream.aclose())
@@ -0,0 +1,136 @@
+###############################################################################
+#  test_handles.py for archivist scour microservice                           #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for the sane handle pool."""
+from threading import Event, Thread
+import pytest
+from app.models.handles import HandleBusy, HandlePool, SaneException
+
+
+class FakeHandle():
+    """Stand in for a sane handle."""
+
+    def __init__(self) -> None:
+        self.alive = True
+        self.closed = False
+
+    def get_parameters(self):
+        if not self.alive:
+            raise SaneException("Error during device I/O")
+        return ('color', 1, (10, 10), 8, 30)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def make_pool(**kwargs) -> tuple:
+    """Return a pool and the list of handles it opened."""
+    opened = []
+
+    def opener(name):
+        opened.append(FakeHandle())
+        return opened[-1]
+
+    return HandlePool(opener=opener, **kwargs), opened
+
+
+def test_handle_reused():
+    """
+    GIVEN a pool
+    WHEN a device is used twice
+    SHOULD open it only once.
+    """
+    pool, opened = make_pool()
+    pool.open('dev')
+    with pool.use('dev') as dev:
+        assert dev is opened[0]
+
+    assert len(opened) == 1
+
+
+def test_broken_handle_reopened_by_probe():
+    """
+    GIVEN an idle handle whose connection dropped
+    WHEN the pool is maintained
+    SHOULD replace it before the next use.
+    """
+    pool, opened = make_pool(idle_ttl=100, probe_interval=0)
+    pool.open('dev')
+    opened[0].alive = False
+
+    pool.maintain()
+
+    assert opened[0].closed
+    with pool.use('dev') as dev:
+        assert dev is opened[1]
+
+
+def test_idle_handle_closed():
+    """
+    GIVEN a handle idle past the ttl
+    WHEN the pool is maintained
+    SHOULD close it and reopen it on the next use.
+    """
+    pool, opened = make_pool(idle_ttl=0)
+    pool.open('dev')
+
+    pool.maintain()
+
+    assert opened[0].closed
+    assert pool.names() == []
+    pool.open('dev')
+    assert len(opened) == 2
+
+
+def test_busy_handle_times_out():
+    """
+    GIVEN a handle held by another thread
+    WHEN the device is used
+    SHOULD give up after the pool's wait instead of blocking.
+    """
+    pool, _ = make_pool(wait=0.05)
+    held, release = Event(), Event()
+
+    def scan():
+        with pool.use('dev'):
+            held.set()
+            release.wait()
+
+    thread = Thread(target=scan)
+    thread.start()
+    held.wait()
+    try:
+        with pytest.raises(HandleBusy):
+            pool.open('dev')
+    finally:
+        release.set()
+        thread.join()
+
+    pool.open('dev')
+
+
+def test_pinned_handle_kept_open():
+    """
+    GIVEN a pre-warmed handle idle past the ttl
+    WHEN the pool is maintained
+    SHOULD keep it open.
+    """
+    pool, opened = make_pool(idle_ttl=0, probe_interval=0)
+    pool.pin('dev')
+
+    pool.maintain()
+
+    assert not opened[0].closed
+    assert pool.names() == ['dev']
@@ -0,0 +1,90 @@
+###############################################################################
+#  test_response_cache.py for archivist scour microservice                    #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for the response cache."""
+from app.models import Job
+from app.routers.cache import (ResponseCache, cached_response, dump_model,
+                               etag_matches, joined_response)
+from PIL import Image
+
+
+def test_cache_rebuilds_on_revision():
+    """
+    GIVEN a cached job body
+    WHEN the job is fetched again unchanged and then after adding a page
+    SHOULD only serialize again after the change.
+    """
+    cache = ResponseCache()
+    job = Job(job_number=1)
+    calls = []
+
+    def producer():
+        calls.append(1)
+        return dump_model(job)
+
+    first = cache.get('job', job.revision(), producer)
+    assert cache.get('job', job.revision(), producer) is first
+    assert len(calls) == 1
+
+    job.add_pages(Image.open('tests/data/lorem1.png'))
+    second = cache.get('job', job.revision(), producer)
+    assert len(calls) == 2
+    assert second.etag != first.etag
+
+
+def test_cached_response_not_modified():
+    """
+    GIVEN a cached body
+    WHEN the client sends a matching If-None-Match header
+    SHOULD return a 304 without a body.
+    """
+    entry = ResponseCache().get('job', 0, lambda: b'{}')
+
+    assert etag_matches(f'W/{entry.etag}, "other"', entry.etag)
+    assert cached_response(entry, entry.etag).status_code == 304
+    assert cached_response(entry, '"other"').body == b'{}'
+
+
+def test_cache_bounded_by_bytes():
+    """
+    GIVEN a cache limited to ten bytes
+    WHEN bodies are added past the limit or asked not to be stored
+    SHOULD evict the oldest and never keep the rest.
+    """
+    cache = ResponseCache(max_bytes=10)
+    cache.get('a', 0, lambda: b'aaaa')
+    cache.get('b', 0, lambda: b'bbbb')
+    cache.get('c', 0, lambda: b'cccc')
+    cache.get('big', 0, lambda: b'x' * 11)
+    cache.get('d', 0, lambda: b'dd', store=False)
+
+    assert cache.size == 8
+    assert cache.get('a', 0, lambda: b'new').body == b'new'
+    assert cache.get('d', 0, lambda: b'new').body == b'new'
+
+
+def test_joined_response():
+    """
+    GIVEN several cached bodies
+    WHEN they are returned as one list
+    SHOULD tag the list from the bodies' tags and honor If-None-Match.
+    """
+    cache = ResponseCache()
+    entries = [cache.get(key, 0, lambda k=key: k.encode())
+               for key in ('1', '2')]
+    etag = joined_response(entries).headers['ETag']
+
+    assert joined_response(entries, etag).status_code == 304
+    assert joined_response(entries[:1]).headers['ETag'] != etag
@@ -0,0 +1,145 @@
+###############################################################################
+#  test_sinks.py for archivist scour microservice                             #
+#  Copyright (c) 2024 Tom Hartman (thomas.lees.hartman@gmail.com)             #
+#                                                                             #
+#  This program is free software; you can redistribute it and/or              #
+#  modify it under the terms of the GNU General Public License                #
+#  as published by the Free Software Foundation; either version 2             #
+#  of the License, or the License, or (at your option) any later              #
+#  version.                                                                   #
+#                                                                             #
+#  This program is distributed in the hope that it will be useful,            #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              #
+#  GNU General Public License for more details.                               #
+###############################################################################
+"""Unit tests for output sinks."""
+import sys
+from app.models import Job
+from app.models.sinks import (DirectorySinkConfig, Page, S3SinkConfig, Sink,
+                              SinkDispatcher, make_sink)
+
+
+class BrokenSink(Sink):
+    """Sink that always fails."""
+
+    def deliver(self, page: Page) -> None:
+        raise OSError("unreachable")
+
+
+class ClosingSink(Sink):
+    """Sink recording when it is closed."""
+
+    def __init__(self, config, client) -> None:
+        super().__init__(config)
+        self.client = client
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class FakeS3():
+    """Stand-in for a boto3 s3 client keeping objects in memory."""
+
+    def __init__(self) -> None:
+        self.kwargs = {}
+        self.objects = {}
+        self.closed = False
+
+    def client(self, service: str, **kwargs) -> 'FakeS3':
+        self.kwargs = {'service': service, **kwargs}
+        return self
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes,
+                   ContentType: str) -> None:
+        self.objects[(Bucket, Key)] = (Body, ContentType)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_directory_sink(tmp_path):
+    """
+    GIVEN a directory sink
+    WHEN a page is dispatched
+    SHOULD write the page and record the delivery on the job.
+    """
+    dispatcher = SinkDispatcher(workers=2, retries=0)
+    sink = make_sink(DirectorySinkConfig(name='archive', path=str(tmp_path)))
+    job = Job(job_number=2)
+    job.add_encoded_page(b'page')
+
+    dispatcher.submit([sink], Page('net1;dev0', job, 0))
+    dispatcher.shutdown()
+
+    assert (tmp_path / 'net1_dev0' / 'job-0002' /
+            'page-0001.jpg').read_bytes() == b'page'
+    assert list(tmp_path.rglob('*.part')) == []
+    assert job.deliveries[0].delivered == 1
+    assert job.deliveries[0].pending == 0
+
+
+def test_failed_delivery_retries():
+    """
+    GIVEN a sink that always fails
+    WHEN a page is dispatched
+    SHOULD retry then record the failure on the job.
+    """
+    dispatcher = SinkDispatcher(workers=1, retries=2, backoff=0.001)
+    job = Job(job_number=0)
+    job.add_encoded_page(b'page')
+
+    dispatcher.submit([BrokenSink(DirectorySinkConfig(name='bad', path=''))],
+                      Page('dev', job, 0))
+    dispatcher.shutdown()
+
+    assert job.deliveries[0].failed == 1
+    assert 'unreachable' in job.deliveries[0].last_error
+    assert dispatcher.pending == 0
+
+
+def test_s3_sink(monkeypatch):
+    """
+    GIVEN an s3 sink backed by a local stand-in for boto3
+    WHEN a page is dispatched and the sink retired
+    SHOULD put the page below the prefix then close the client.
+    """
+    client = FakeS3()
+    monkeypatch.setitem(sys.modules, 'boto3', client)
+    dispatcher = SinkDispatcher(workers=1, retries=0)
+    sink = make_sink(S3SinkConfig(name='bucket', bucket='scans',
+                                  prefix='/office/',
+                                  endpoint_url='http://minio:9000',
+                                  secret_key='hidden'))
+    job = Job(job_number=1)
+    job.add_encoded_page(b'page')
+
+    dispatcher.submit([sink], Page('dev', job, 0))
+    dispatcher.retire([sink])
+    dispatcher.shutdown()
+
+    assert client.objects == {('scans', 'office/dev/job-0001/page-0001.jpg'):
+                              (b'page', 'image/jpeg')}
+    assert client.kwargs['service'] == 's3'
+    assert client.kwargs['endpoint_url'] == 'http://minio:9000'
+    assert client.closed
+    assert job.deliveries[0].delivered == 1
+
+
+def test_retired_sink_held_by_scan():
+    """
+    GIVEN a sink held by a running scan
+    WHEN it is retired, e.g. replaced on the device
+    SHOULD stay open until the scan releases it.
+    """
+    dispatcher = SinkDispatcher(workers=1, retries=0)
+    client = FakeS3()
+    sink = ClosingSink(DirectorySinkConfig(name='held', path=''), client)
+
+    dispatcher.hold([sink])
+    dispatcher.retire([sink])
+    assert not client.closed
+
+    dispatcher.release([sink])
+    dispatcher.shutdown()
+    assert client.closed